@@ -4,16 +4,23 @@ import argparse
 import logging
 import random
 import asyncio
-from pymongo import MongoClient, UpdateOne
 from datetime import datetime, timezone
-from dotenv import load_dotenv
-import json
-import aiohttp
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
 from send_transactions import send_transactions
+from sampling import SAMPLING_STRATEGIES, sample_collection
+from async_mongo import connect_async
+from metrics import current_context
+from status_server import start_status_server
+from concurrency import DEFAULT_CEILING, set_ceiling, unbounded_connector
+from profile_updates import ProfileUpdateQueue
+from http_policy import set_gzip, set_response_mode
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
 
 # Load and define environment variables based on argument
 def load_environment_variables(context):
+    from dotenv import load_dotenv
     # Specify the path to the .env file in the root directory
     env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
     load_dotenv(dotenv_path=env_path)
@@ -45,65 +52,19 @@ def setup_logging():
     logger = logging.getLogger(__name__)
     return logger
 
-# MongoDB connection setup
+# MongoDB connection setup; collection calls are awaited and run off the event loop
 def connect_mongo(mongo_uri, mongo_db_name):
-    client = MongoClient(mongo_uri)
-    db = client[mongo_db_name]
-    return db
-
-# Function to fetch data based on context
-def fetch_data(collection_name, db):
-    collection = db[collection_name]
-    data = collection.find().sort("timestamp", -1)  # Sort by timestamp in descending order
-    return data
-
-# Function to send user profile update to REST API
-async def send_user_profile_update(session, api_url, auth, user_id, logger, log_entries):
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': auth.encode()  # This will be Basic <base64 encoded username:password>
-    }
-    user_profile_data = {
-        "user_profile": {
-            "is_anomalous": True
-        }
-    }
-    log_entry = {
-        "user_id": user_id,
-        "request": {
-            "url": api_url.format(user_id=user_id),
-            "headers": headers,
-            "body": user_profile_data
-        }
-    }
-    try:
-        async with session.put(api_url.format(user_id=user_id), headers=headers, json=user_profile_data) as response:
-            status = response.status
-            response_text = await response.text()
-            logger.info(f"User profile update Response Status: {status}, Response Text: {response_text}")
-            try:
-                response_json = await response.json()
-                log_entry["response"] = response_json
-                print(f"User profile update JSON Response: {response_json}")
-            except Exception as e:
-                logger.error(f"Error parsing JSON response: {e}")
-                log_entry["response"] = response_text  # Store the raw response text if JSON parsing fails
-            return {"status": status, "response": response_text}
-    except aiohttp.ClientError as e:
-        logger.error(f"Client error: {e}")
-        log_entry["response"] = str(e)
-        return {"status": "error", "response": str(e)}
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        log_entry["response"] = str(e)
-        return {"status": "error", "response": str(e)}
-    finally:
-        log_entries.append(log_entry)
+    return connect_async(mongo_uri, mongo_db_name)
 
 # Main function to orchestrate fetching data and sending transactions
-async def burst_transactions(context, enable_logging, num_transactions_per_user):
+async def burst_transactions(context, enable_logging, num_transactions_per_user, sampling='uniform'):
+    import aiohttp
+    import numpy as np
+    from pymongo import UpdateOne
+
     # Load environment variables
     env_vars = load_environment_variables(context)
+    current_context.set(context)
 
     # Setup logging
     if enable_logging:
@@ -115,60 +76,72 @@ async def burst_transactions(context, enable_logging, num_transactions_per_user)
     # Connect to MongoDB
     db = connect_mongo(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
 
-    # Fetch data
-    data = fetch_data(env_vars['MONGO_COLLECTION_NAME'], db)
-    user_ids_with_timestamp = [{'user_id': doc['user_id'], 'timestamp': doc['timestamp']} for doc in data]
-    total_collection_size = len(user_ids_with_timestamp)
+    # Count the collection
+    collection = db[env_vars['MONGO_COLLECTION_NAME']]
+    total_collection_size = await collection.count_documents({})
 
     # Define the sample size (1% of total collection size)
     sample_size = max(1, int(total_collection_size * 0.01))  # Ensure at least 1 user is sampled
-    sample_users = user_ids_with_timestamp[:sample_size]
-    sample_user_ids = [doc['user_id'] for doc in sample_users]
-
-    # API URL for user profile update
-    CUSTOMERS_API = f'/priv/v1/apps/{env_vars["USERNAME"]}/users/{{user_id}}/models/user_profile'
-    API_URL = env_vars['HOST'] + CUSTOMERS_API
+    sample_users = await collection.run(sample_collection, sampling, sample_size, projection={'_id': 0, 'user_id': 1, 'persona': 1},
+                                        context=context)
+    new_personas = sample_users.fill_missing_personas(context)
+    sample_user_ids = sample_users.user_ids()
 
     auth = aiohttp.BasicAuth(login=env_vars['USERNAME'], password=env_vars['PASSWORD'])
 
-    log_entries = []
-
-    async with aiohttp.ClientSession() as session:
-        # Send transactions for each user in the sample
-        for user_id in sample_user_ids:
-            await send_transactions([user_id] * num_transactions_per_user, context, enable_logging)
-
-            # Send user profile update for each user in the sample
-            await send_user_profile_update(session, API_URL, auth, user_id, logger, log_entries)
-
-    # Update sampled users in MongoDB with the last transaction timestamp and is_anomalous flag
+    # Update sampled users in MongoDB with the last transaction timestamp and is_anomalous flag,
+    # in the background while the bursts are sent
     lasttxn_timestamp = datetime.now(timezone.utc).isoformat()
     updates = [
         UpdateOne(
-            {'user_id': user['user_id']},
-            {'$set': {'lasttxn_timestamp': lasttxn_timestamp, 'is_anomalous': True}}
+            {'user_id': user_id},
+            {'$set': {'lasttxn_timestamp': lasttxn_timestamp, 'is_anomalous': True,
+                      **({'persona': sample_users.persona(row)} if new_personas[row] else {})}}
         )
-        for user in sample_users
+        for row, user_id in enumerate(sample_user_ids)
     ]
-    db[env_vars['MONGO_COLLECTION_NAME']].bulk_write(updates)
+    pending_write = asyncio.create_task(collection.bulk_write(updates)) if updates else None
+
+    async with aiohttp.ClientSession(connector=unbounded_connector()) as session:
+        # Each user's burst is sent in order and the user is flagged once it has gone out, as before;
+        # different users' bursts and profile updates run concurrently
+        profile_updates = ProfileUpdateQueue(session, env_vars['HOST'], env_vars['USERNAME'], auth, logger)
+        bursts = sample_users[np.repeat(np.arange(len(sample_users)), num_transactions_per_user)]
+        await send_transactions(bursts.user_ids(), context, enable_logging, personas=bursts.personas, burst=num_transactions_per_user,
+                                after_burst=lambda user_id: profile_updates.update(user_id, {"is_anomalous": True}))
+        update_counts = await profile_updates.close()
 
-    # Write all log entries to a single log file
-    log_filename = os.path.join('logs', 'user_profile_updates.log')
-    with open(log_filename, 'w') as log_file:
-        json.dump(log_entries, log_file, indent=4)
+    if pending_write:
+        await pending_write
 
     # Print the total collection size and number of transactions sent
     print(f"Total collection size: {total_collection_size}")
-    print(f"Number of transactions sent: {sample_size * num_transactions_per_user}")
+    print(f"Profile updates sent: {update_counts['sent']} (success: {update_counts['success']}, failed: {update_counts['failed']})")
+    print(f"Number of transactions sent: {len(sample_user_ids) * num_transactions_per_user}")
 
-if __name__ == '__main__':
-    # Setup argument parser
-    parser = argparse.ArgumentParser(description='Generate and send random transactions.')
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Generate and send random transactions.')
     parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
     parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
     parser.add_argument('--burstAmount', type=int, default=10, help='Number of transactions per user in the sample.')
+    parser.add_argument('--sampling', choices=SAMPLING_STRATEGIES, default='uniform', help='Strategy used to pick the sampled users.')
+    parser.add_argument('--maxInFlight', type=int, default=DEFAULT_CEILING, help='Maximum concurrent requests to each API. Concurrency adapts below this from observed latency and errors.')
+    add_run_options(parser, progress='while the burst runs', responses='transaction and profile update')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    set_ceiling(args.maxInFlight, 'transactions', 'profile_updates')
+    set_response_mode(args.responses, args.enableLogging, 'transactions', 'profile_updates')
+    set_gzip(args.gzipRequests, 'transactions', 'profile_updates')
+    return profiled(args.profile, 'burst', recorded('burst', args.context, burst_transactions(
+        args.context, args.enableLogging, args.burstAmount, args.sampling)))
 
-    args = parser.parse_args()
+if __name__ == '__main__':
+    args = build_parser().parse_args()
 
     # Run the main function
-    asyncio.run(burst_transactions(args.context, args.enableLogging, args.burstAmount))
+    asyncio.run(run(args))
@@ -1,14 +1,17 @@
+import sys
 import os
 import json
 import argparse
 import asyncio
-import aiohttp
-from aiohttp import BasicAuth
-from dotenv import load_dotenv
 import logging
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
 
 # Load and define environment variables based on argument
 def load_environment_variables(context):
+    from dotenv import load_dotenv
     load_dotenv()
     env_vars = {
         'HOST': os.getenv(f'{context.upper()}_CORE_HOST'),
@@ -37,6 +40,8 @@ def setup_logging():
 
 # Function to fetch campaigns for a user
 async def fetch_campaigns(user_id, env_vars):
+    import aiohttp
+    from aiohttp import BasicAuth
     auth = BasicAuth(login=env_vars['USERNAME'], password=env_vars['PASSWORD'])
     api_url = f"{env_vars['HOST']}/priv/v1/apps/{env_vars['USERNAME']}/users/{user_id}/campaigns"
 
@@ -83,12 +88,21 @@ async def main(context, user_id, enable_logging, type_filter):
     campaigns = await fetch_campaigns(user_id, env_vars)
     filter_and_print_internal_tiles(campaigns, type_filter)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Fetch and print internal tile campaigns for a user.')
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Fetch and print internal tile campaigns for a user.')
     parser.add_argument('--context', required=True, choices=['retail', 'qsr', 'fuel'], help='Specify the context: retail, qsr, or fuel')
     parser.add_argument('--user_id', required=True, help='Specify the user ID')
     parser.add_argument('--enableLogging', action='store_true', help='Enable logging')
     parser.add_argument('--typeFilter', required=False, help='Specify the custom_payload type to filter by')
-    args = parser.parse_args()
+    add_run_options(parser)
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    return profiled(args.profile, 'campaigns', recorded('campaigns', args.context, main(
+        args.context, args.user_id, args.enableLogging, args.typeFilter)))
 
-    asyncio.run(main(args.context, args.user_id, args.enableLogging, args.typeFilter))
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,64 @@
+import sys
+import os
+import argparse
+import asyncio
+import importlib.util
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand name -> (script path relative to the repo root, help text)
+# Scripts are only loaded when their subcommand runs, and each script defers
+# its heavy imports (aiohttp, pymongo, Faker, dotenv) until they are needed.
+COMMANDS = {
+    'customers': ('customers/generate_customers.py', 'Generate new customers and optionally send first transactions.'),
+    'txns': ('customers/txn_randomizer.py', 'Send transactions to a random sample of existing customers.'),
+    'backfill': ('customers/backfill.py', 'Backfill days of historical transactions with back-dated timestamps.'),
+    'burst': ('anomaly-detection/frequent-transactions.py', 'Burst transactions for a sample of users to trigger anomaly detection.'),
+    'tiles': ('campaigns/get_campaign_tiles.py', 'Fetch internal campaign tiles for a user.'),
+    'campaigns': ('campaigns/get_campaigns_by_userid.py', 'Fetch campaigns for a user.'),
+    'replay': ('utils/replay.py', 'Send a dataset written with --export to the APIs.'),
+    'coordinator': ('utils/coordinator.py', 'Split a customer generation run into chunks shared by workers.'),
+    'worker': ('utils/worker.py', 'Claim and run chunks of distributed runs from MongoDB.'),
+    'scheduler': ('utils/scheduler.py', 'Run customer generation on an hourly schedule.'),
+    'report': ('utils/run_report.py', 'Compare recent runs from the run history and flag throughput regressions.'),
+}
+
+_loaded_commands = {}
+
+# Load the script module behind a subcommand by file path (some live in hyphenated directories)
+def load_command(command):
+    if command in _loaded_commands:
+        return _loaded_commands[command]
+
+    relative_path, _ = COMMANDS[command]
+    path = os.path.join(ROOT_DIR, relative_path)
+    module_name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    _loaded_commands[command] = module
+    return module
+
+# Parse a subcommand's arguments and run it inside the current event loop
+async def run_command(command, argv):
+    module = load_command(command)
+    args = module.build_parser(prog=f"cli.py {command}").parse_args(argv)
+    return await module.run(args)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='SessionM demo utilities.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='commands:\n' + '\n'.join(f"  {name:<12}{help_text}" for name, (_, help_text) in COMMANDS.items())
+    )
+    parser.add_argument('command', choices=list(COMMANDS), metavar='command', help='Subcommand to run (see below).')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments passed to the subcommand.')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    asyncio.run(run_command(args.command, args.args))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,218 @@
+import sys
+import os
+import argparse
+import logging
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+from send_transactions import send_transaction_batch, generate_transactions
+from idempotency import stable_seed
+from async_mongo import connect_async
+from metrics import current_context
+from status_server import start_status_server
+from concurrency import set_ceiling, unbounded_connector
+from http_policy import set_gzip, set_response_mode
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
+
+# Transactions built and queued at a time while a day is being sent
+CHUNK_SIZE = 5000
+
+# Load and define environment variables based on argument
+def load_environment_variables(context):
+    from dotenv import load_dotenv
+    # Specify the path to the .env file in the root directory
+    env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+    load_dotenv(dotenv_path=env_path)
+    env_vars = {
+        'CLOUDPOS_ENDPOINT': os.getenv(f'{context.upper()}_CLOUDPOS_ENDPOINT'),
+        'AUTH_TOKEN': os.getenv(f'{context.upper()}_CLOUDPOS_AUTH_TOKEN'),
+        'STORE_ID': os.getenv(f'{context.upper()}_STORE_ID'),
+        'CLIENT_ID': os.getenv(f'{context.upper()}_CLIENT_ID'),
+        'MONGO_URI': os.getenv(f'{context.upper()}_MONGO_URI'),
+        'MONGO_DB_NAME': os.getenv(f'{context.upper()}_MONGO_DB_NAME'),
+        'MONGO_COLLECTION_NAME': os.getenv(f'{context.upper()}_MONGO_COLLECTION_NAME')
+    }
+
+    for key, value in env_vars.items():
+        if value is None:
+            raise ValueError(f"Essential environment variable {key} is not set for context {context}.")
+
+    return env_vars
+
+# Configure logging
+def setup_logging():
+    LOG_DIR = 'logs'
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(LOG_DIR, 'backfill.log'),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    return logger
+
+# MongoDB connection setup
+def connect_mongo(mongo_uri, mongo_db_name):
+    return connect_async(mongo_uri, mongo_db_name)
+
+# Pack every customer that can receive transactions; run on the Mongo executor so the cursor streams into the arrays
+def load_customers(collection, context):
+    from population import Population
+    return Population.from_documents(
+        collection.find({'external_id': {'$exists': True}}, {'_id': 0, 'user_id': 1, 'external_id': 1, 'persona': 1}),
+        ['user_id', 'external_id', 'persona'], context)
+
+# Draw one day of transactions: a Poisson count per customer from their weekly frequency,
+# then back-dated times of day following the context's diurnal curve
+def plan_day(customers, context, day_start, utc_offset, rng):
+    import numpy as np
+    from traffic import sample_times_of_day
+
+    weekly_frequency = customers.personas['weekly_frequency'].astype(np.float64)
+    counts = rng.poisson(weekly_frequency / 7.0)
+    picks = np.repeat(np.arange(len(customers)), counts)
+    timestamps = day_start + sample_times_of_day(context, len(picks), utc_offset, rng)
+    order = np.argsort(timestamps)
+    return picks[order], timestamps[order]
+
+# Checkpoint of one backfilled day of a context in the backfill_checkpoints collection
+def checkpoint_id(context, day):
+    return f"{context}:{day.isoformat()}"
+
+# Main function: send N days of back-dated transactions, checkpointing each completed day in MongoDB
+# A day with more than max_failures failed transactions is left unchecked, so a rerun sends it again
+async def backfill_transactions(context, enable_logging, days, end_date, utc_offset, max_in_flight, max_failures=0):
+    import aiohttp
+    import numpy as np
+    from pymongo import UpdateOne
+
+    env_vars = load_environment_variables(context)
+    current_context.set(context)
+    if enable_logging:
+        logger = setup_logging()
+    else:
+        logger = logging.getLogger(__name__)
+        logger.addHandler(logging.NullHandler())
+
+    db = connect_mongo(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
+    collection = db[env_vars['MONGO_COLLECTION_NAME']]
+    checkpoints = db['backfill_checkpoints']
+
+    # Load every customer that can receive transactions, giving personas to any that predate them
+    customers = await collection.run(load_customers, context)
+    if not len(customers):
+        print("No customers to backfill.")
+        return
+    new_personas = np.flatnonzero(customers.fill_missing_personas(context))
+    if len(new_personas):
+        await collection.bulk_write([
+            UpdateOne({'user_id': user_id}, {'$set': {'persona': customers.persona(row)}})
+            for row, user_id in zip(new_personas.tolist(), customers[new_personas].user_ids())
+        ])
+
+    # Completed days are checkpointed per context and day rather than per date range, so re-running the command
+    # resumes it even on a later day (when the default --endDate has moved), and a day that any earlier backfill
+    # of the context completed is never sent again
+    first_day = end_date - timedelta(days=days)
+    day_ids = [checkpoint_id(context, first_day + timedelta(days=offset)) for offset in range(days)]
+    completed_days = {doc['day'] for doc in await checkpoints.find({'_id': {'$in': day_ids}}, {'_id': 0, 'day': 1})}
+    if completed_days:
+        print(f"Resuming backfill of {context} from {first_day.isoformat()}: {len(completed_days)} of {days} days already sent")
+
+    last_txn = np.full(len(customers), -np.inf)
+    totals = {"sent": 0, "success": 0, "failed": 0}
+    run_start = time.time()
+
+    async with aiohttp.ClientSession(connector=unbounded_connector()) as session:
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            if day.isoformat() in completed_days:
+                continue
+
+            # Each day draws from generators seeded by its checkpoint, so a day that was interrupted
+            # is re-sent with the same transactions and request ids rather than a fresh set
+            day_id = checkpoint_id(context, day)
+            rng = np.random.default_rng(stable_seed(day_id))
+            id_rng = np.random.default_rng(stable_seed(day_id, 'ids'))
+            day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+            picks, timestamps = plan_day(customers, context, day_start, utc_offset, rng)
+            day_counts = {"success": 0, "failed": 0}
+            day_start_time = time.time()
+
+            for chunk_start in range(0, len(picks), CHUNK_SIZE):
+                chunk_customers = customers[picks[chunk_start:chunk_start + CHUNK_SIZE]]
+                transactions = generate_transactions(chunk_customers.external_ids(), context, env_vars, chunk_customers.personas, rng,
+                                                     timestamps=timestamps[chunk_start:chunk_start + CHUNK_SIZE], id_rng=id_rng)
+                results = await send_transaction_batch(session, transactions, env_vars['AUTH_TOKEN'], env_vars['CLOUDPOS_ENDPOINT'],
+                                                       logger, max_in_flight)
+                for result in results:
+                    day_counts["success" if result["status"] == 200 else "failed"] += 1
+
+            np.maximum.at(last_txn, picks, timestamps)
+            if day_counts["failed"] <= max_failures:
+                await checkpoints.update_one(
+                    {'_id': day_id},
+                    {'$set': {'context': context, 'day': day.isoformat(), 'sent': len(picks), 'success': day_counts["success"],
+                              'failed': day_counts["failed"], 'updated_at': datetime.now(timezone.utc)}},
+                    upsert=True
+                )
+
+            totals["sent"] += len(picks)
+            totals["success"] += day_counts["success"]
+            totals["failed"] += day_counts["failed"]
+            elapsed = max(time.time() - day_start_time, 1e-9)
+            print(f"{day.isoformat()} - sent: {len(picks)}, success: {day_counts['success']}, failed: {day_counts['failed']}, "
+                  f"rate: {len(picks) / elapsed:.0f}/s")
+            if day_counts["failed"] <= max_failures:
+                logger.info(f"Backfill {day_id} complete: {day_counts}")
+            else:
+                print(f"{day.isoformat()} left unchecked: {day_counts['failed']} transactions failed, more than --maxFailures "
+                      f"({max_failures}), so a rerun sends the day again")
+                logger.warning(f"Backfill {day_id} not checkpointed: {day_counts}")
+
+    # Move lasttxn_timestamp forward for customers whose newest backfilled transaction is newer
+    sent_rows = np.flatnonzero(np.isfinite(last_txn))
+    updates = [
+        UpdateOne({'user_id': user_id},
+                  {'$max': {'lasttxn_timestamp': datetime.fromtimestamp(float(last_txn[row]), timezone.utc).isoformat()}})
+        for row, user_id in zip(sent_rows.tolist(), customers[sent_rows].user_ids())
+    ]
+    if updates:
+        await collection.bulk_write(updates)
+
+    elapsed = max(time.time() - run_start, 1e-9)
+    print(f"Total customers: {len(customers)}")
+    print(f"Number of transactions sent: {totals['sent']} (success: {totals['success']}, failed: {totals['failed']}) "
+          f"in {elapsed:.0f}s, {totals['sent'] / elapsed:.0f}/s")
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Backfill days of historical transactions for existing customers.')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
+    parser.add_argument('--days', type=int, default=180, help='Number of days of history to generate.')
+    parser.add_argument('--endDate', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        default=datetime.now(timezone.utc).date(), help='Last day (exclusive, YYYY-MM-DD) of the backfill. Defaults to today (UTC).')
+    parser.add_argument('--utcOffset', type=float, default=0.0, help='Offset from UTC, in hours, of the stores the diurnal curve describes.')
+    parser.add_argument('--maxInFlight', type=int, default=100, help='Maximum concurrent requests to CloudPOS. Concurrency adapts below this from observed latency and errors.')
+    parser.add_argument('--maxFailures', type=int, default=0,
+                        help='Failed transactions a day may have and still be checkpointed as done (default %(default)s). '
+                             'A day with more is left unchecked and sent again by the next run.')
+    parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
+    add_run_options(parser, progress='while the backfill runs', responses='transaction')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    set_ceiling(args.maxInFlight, 'transactions')
+    set_response_mode(args.responses, args.enableLogging, 'transactions')
+    set_gzip(args.gzipRequests, 'transactions')
+    return profiled(args.profile, 'backfill', recorded('backfill', args.context, backfill_transactions(
+        args.context, args.enableLogging, args.days, args.endDate, args.utcOffset, args.maxInFlight, args.maxFailures)))
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+
+    # Run the main function
+    asyncio.run(run(args))
@@ -5,19 +5,27 @@ import uuid
 import json
 import re
 import asyncio
-import aiohttp
 import argparse
-from aiohttp import BasicAuth
-from dotenv import load_dotenv
-from faker import Faker
 from datetime import datetime, timezone
 import logging
-from pymongo import MongoClient
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
-from send_transactions import send_transactions
+from async_mongo import connect_async
+from targets import new_run_id
+from idempotency import deterministic_id, membership_cache, recheck_external_ids
+from metrics import metrics, current_context
+from concurrency import DEFAULT_CEILING, TrackedRequest, set_ceiling, unbounded_connector
+from status_server import start_status_server
+from profiling import profiler, profiled
+from run_options import add_run_options
+from run_history import recorded
+from http_policy import encode_body, read_response, set_gzip, set_response_mode
+
+# Fresh emails tried for a customer whose email already exists before the customer is skipped
+EMAIL_ATTEMPTS = 5
 
 # Load and define environment variables based on argument
 def load_environment_variables(context):
+    from dotenv import load_dotenv
     # Specify the path to the .env file in the root directory
     env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
     load_dotenv(dotenv_path=env_path)
@@ -58,6 +66,7 @@ def generate_email(first_name, last_name):
     return f"{first_name.lower()}.{last_name.lower()}{random.randint(100,999)}@sessionmdemo.com"
 
 # Function to parse a full street address into components
+@profiler.staged("parse_address")
 def parse_address(address):
     address_pattern = re.compile(
         r'(?P<street_address>[\d\s\w.,-]+)\s*,?\s*'
@@ -78,23 +87,28 @@ def parse_address(address):
 
 # Function to send data to REST API asynchronously
 async def send_to_api(session, data, auth, api_url):
-    headers = {'Content-Type': 'application/json'}
-    try:
-        async with session.post(api_url, headers=headers, json=data, auth=auth) as response:
-            status = response.status
-            response_text = await response.text()
-            logger.info(f"Response Status: {status}, Response Text: {response_text}")
-            return {"status": status, "response": response_text}
-    except aiohttp.ClientError as e:
-        logger.error(f"Client error: {e}")
-        return {"status": "error", "response": str(e)}
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return {"status": "error", "response": str(e)}
+    import aiohttp
+    with profiler.stage("encode"):
+        body, encoding_headers = encode_body("customers", data)
+    headers = {'Content-Type': 'application/json', **encoding_headers}
+    async with TrackedRequest("customers") as request:
+        try:
+            async with session.post(api_url, headers=headers, data=body, auth=auth) as response:
+                status = request.status = response.status
+                response_text = await read_response("customers", response)
+                logger.info(f"Response Status: {status}, Response Text: {response_text}")
+                return {"status": status, "response": response_text}
+        except aiohttp.ClientError as e:
+            logger.error(f"Client error: {e}")
+            return {"status": "error", "response": str(e)}
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return {"status": "error", "response": str(e)}
 
 # Function to generate customer data
-def generate_customer_data(context):
-    external_id = str(uuid.uuid4())
+@profiler.staged("generate")
+def generate_customer_data(context, external_id=None):
+    external_id = external_id or str(uuid.uuid4())
     first_name = fake.first_name()
     last_name = fake.last_name()
     email = generate_email(first_name, last_name)
@@ -154,27 +168,66 @@ def generate_customer_data(context):
     return base_data
 
 # Generate random data
-async def generate_and_send_data(context, env_vars, enable_logging, locale):
+# num_customers is set by job queue workers (one chunk of a distributed run); by default a random count is used
+# run_id is stored on every customer so later runs can target the customers created by the latest run
+# External ids are derived from run_id and the customer's position (offset by sequence_start), so a retried
+# chunk regenerates the same ids and skips the customers that already exist; with recheck, the ids are also looked
+# up in MongoDB, as another process may have created some of them since this process's cache was warmed
+async def generate_and_send_data(context, env_vars, enable_logging, locale, num_customers=None, run_id=None, sequence_start=0,
+                                 recheck=False):
+    import aiohttp
+    from aiohttp import BasicAuth
+    from personas import generate_personas
     auth = BasicAuth(login=env_vars['USERNAME'], password=env_vars['PASSWORD'])
     api_url = env_vars['HOST'] + f'/priv/v1/apps/{env_vars["USERNAME"]}/users'
-    mongo_client = MongoClient(env_vars['MONGO_URI'])
-    db = mongo_client[env_vars['MONGO_DB_NAME']]
+    run_id = run_id or new_run_id(context)
+    current_context.set(context)
+    db = connect_async(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
     collection = db[env_vars['MONGO_COLLECTION_NAME']]
 
-    async with aiohttp.ClientSession() as session:
+    # Existing external_ids and emails, checked before any request goes out
+    cache = await collection.run(membership_cache)
+
+    async with aiohttp.ClientSession(connector=unbounded_connector()) as session:
         tasks = []
-        user_ids = []
+        personas_by_external_id = {}
         user_records = []
 
         # ------------------------ VERY IMPORTANT RANGE SETTING  ---------------------------
         # This determines the min and max number of customer profiles that will be generated
-        # DO NOT EXCEED MAX OF 500
-        for _ in range(random.randint(50, 250)):
-            customer_data = generate_customer_data(context)
+        # DO NOT EXCEED MAX OF 500 (job queue chunks are capped at the same max)
+        num_customers = num_customers or random.randint(50, 250)
+        if recheck:
+            await collection.run(recheck_external_ids, cache,
+                                 [deterministic_id(run_id, sequence) for sequence in range(sequence_start, sequence_start + num_customers)])
+
+        # Each customer gets a behavioral persona that drives their future transactions
+        personas = generate_personas(num_customers, context)
+        batch_emails = set()
+        skipped = 0
+        for sequence, persona in enumerate(personas, start=sequence_start):
+            external_id = deterministic_id(run_id, sequence)
+            if cache.seen(external_id=external_id):
+                skipped += 1
+                continue
+            customer_data = generate_customer_data(context, external_id)
+            for _ in range(EMAIL_ATTEMPTS):
+                email = customer_data["email"]
+                if not cache.seen(email=email) and email.lower() not in batch_emails:
+                    break
+                customer_data["email"] = generate_email(customer_data["first_name"], customer_data["last_name"])
+            else:
+                skipped += 1
+                continue
+            batch_emails.add(customer_data["email"].lower())
             data = {"user": customer_data}
             tasks.append(send_to_api(session, data, auth, api_url))
-            user_ids.append(customer_data["external_id"])
+            personas_by_external_id[customer_data["external_id"]] = persona
+
+        if skipped:
+            logger.info(f"Skipped {skipped} customers whose external_id or email already exists")
 
+        metrics.plan("customers", len(tasks))
         results = await asyncio.gather(*tasks)
 
         # Log the full results for debugging
@@ -182,13 +235,13 @@ async def generate_and_send_data(context, env_vars, enable_logging, locale):
         for result in results:
             logger.info(result)
 
+        responses = [result["response"] for result in results if "response" in result]
         if enable_logging:
             # Create the filename with timestamp
             timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
             filename = os.path.join('logs', f"generate_customers_{timestamp}.json")
 
-            # Extract and write the responses to the local JSON file
-            responses = [result["response"] for result in results if "response" in result]
+            # Write the responses to the local JSON file
             with open(filename, 'w') as file:
                 json.dump(responses, file, indent=4)
 
@@ -203,35 +256,122 @@ async def generate_and_send_data(context, env_vars, enable_logging, locale):
                         user_id = response_json["user"]["id"]
                         external_id = response_json["user"]["external_id"]
                         email = response_json["user"]["email"]
-                        user_records.append({"user_id": user_id, "external_id": external_id, "email": email, "timestamp": datetime.now(timezone.utc)})
+                        user_records.append({"user_id": user_id, "external_id": external_id, "email": email,
+                                             "timestamp": datetime.now(timezone.utc), "persona": personas_by_external_id.get(external_id),
+                                             "run_id": run_id})
+                        cache.add(external_id, email)
                 except (json.JSONDecodeError, KeyError) as e:
                     logger.error(f"Error parsing response: {e}")
 
         if user_records:
-            collection.insert_many(user_records)
+            await collection.insert_many(user_records)
             logger.info(f"{len(user_records)} user records stored in MongoDB")
 
         logger.info(f"Summary of responses: {responses}")
 
-        return [record["external_id"] for record in user_records]
+        return user_records
+
+# Generate customers (and optionally first transactions) straight to files instead of sending them
+def export_data(context, send_txns, export_dir, export_format, num_customers, batch_size):
+    from dotenv import load_dotenv
+    from export import DatasetWriter, write_manifest
+    from personas import generate_personas
+    from send_transactions import generate_transactions
+    from sampling import uniform_sample
+
+    # Store and client ids are stamped again by the replay command, so they are optional here
+    load_dotenv(dotenv_path=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env')))
+    txn_env_vars = {
+        'STORE_ID': os.getenv(f'{context.upper()}_STORE_ID') or '',
+        'CLIENT_ID': os.getenv(f'{context.upper()}_CLIENT_ID') or ''
+    }
+
+    customers = DatasetWriter(export_dir, 'customers', export_format, batch_size)
+    transactions = DatasetWriter(export_dir, 'transactions', export_format, batch_size) if send_txns else None
 
-async def main(context, send_txns, enable_logging, locale):
+    for batch_start in range(0, num_customers, batch_size):
+        personas = generate_personas(min(batch_size, num_customers - batch_start), context)
+        records = []
+        for persona in personas:
+            customer_data = generate_customer_data(context)
+            records.append({"external_id": customer_data["external_id"], "email": customer_data["email"],
+                            "persona": persona, "payload": {"user": customer_data}})
+        customers.write(records)
+
+        if transactions is not None:
+            # Same first-transaction share as a live run
+            first_txn_users = uniform_sample(records, int(len(records) * 0.4))
+            batch = generate_transactions([user["external_id"] for user in first_txn_users], context, txn_env_vars,
+                                          [user["persona"] for user in first_txn_users])
+            transactions.write([
+                {"external_id": transaction_data["request_payload"]["payments"][0]["user_id"],
+                 "open_time": transaction_data["request_payload"]["open_time"],
+                 "total": transaction_data["request_payload"]["payments"][0]["amount"],
+                 "payload": transaction_data}
+                for transaction_data in batch
+            ])
+
+    datasets = {"customers": customers.close()}
+    if transactions is not None:
+        datasets["transactions"] = transactions.close()
+    write_manifest(export_dir, context, datasets)
+
+    for name, summary in datasets.items():
+        print(f"Exported {summary['records']} {name} to {export_dir} ({summary['parts']} {summary['format']} files)")
+
+async def main(context, send_txns, enable_logging, locale, export_dir=None, export_format='ndjson', count=None, batch_size=10000,
+               run_id=None, sequence_start=0, recheck=False):
+    from faker import Faker
     global fake
     fake = Faker([locale])
     if enable_logging:
         setup_logging()
+    if export_dir:
+        # Exports are not sent, so --count may exceed the live range in generate_and_send_data
+        export_data(context, send_txns, export_dir, export_format, count or random.randint(50, 250), batch_size)
+        return
     env_vars = load_environment_variables(context)
-    user_ids = await generate_and_send_data(context, env_vars, enable_logging, locale)
+    user_records = await generate_and_send_data(context, env_vars, enable_logging, locale, count, run_id, sequence_start, recheck)
+    first_txn_users = []
     if send_txns:
         from send_transactions import send_transactions
-        await send_transactions(user_ids, context, enable_logging)
+        from sampling import uniform_sample
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Generate and send customer data.')
+        # --------------------------- VERY IMPORTANT SETTING  ---------------------------
+        # This determines the percentage of new customers that send a first transaction
+        # Generally, we do not want 100% of new customers to send a transaction
+        first_txn_users = uniform_sample(user_records, int(len(user_records) * 0.4))
+        await send_transactions([user["external_id"] for user in first_txn_users], context, enable_logging,
+                                personas=[user["persona"] for user in first_txn_users])
+    return {"customers": len(user_records), "first_transactions": len(first_txn_users)}
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Generate and send customer data.')
     parser.add_argument('--context', required=True, choices=['retail', 'qsr', 'fuel'], help='Specify the context: retail, qsr, or fuel')
     parser.add_argument('--locale', required=True, choices=['en_US', 'es_MX', 'pt_PT'], help='Specify the locale: en_US, es_MX, pt_PT')
     parser.add_argument('--sendTxns', action='store_true', help='Send transactions after creating customers')
     parser.add_argument('--enableLogging', action='store_true', help='Enable logging')
-    args = parser.parse_args()
+    parser.add_argument('--export', metavar='DIR', help='Write generated customers (and first transactions with --sendTxns) to files in DIR instead of sending them')
+    parser.add_argument('--exportFormat', choices=['ndjson', 'parquet'], default='ndjson', help='File format for --export')
+    parser.add_argument('--count', type=int, help='Number of customers to generate with --export (defaults to the live range)')
+    parser.add_argument('--batchSize', type=int, default=10000, help='Records per exported file')
+    parser.add_argument('--maxInFlight', type=int, default=DEFAULT_CEILING, help='Maximum concurrent requests to each API. Concurrency adapts below this from observed latency and errors.')
+    add_run_options(parser, progress='while the run is going', responses='transaction')
+    return parser
 
-    asyncio.run(main(args.context, args.sendTxns, args.enableLogging, args.locale))
\ No newline at end of file
+# Run the script from parsed arguments
+def run(args):
+    if args.count and not args.export:
+        raise ValueError("--count is only supported with --export; live runs use the range setting in generate_and_send_data.")
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    set_ceiling(args.maxInFlight, 'customers', 'transactions')
+    set_response_mode(args.responses, args.enableLogging, 'transactions')
+    set_gzip(args.gzipRequests, 'customers', 'transactions')
+    return profiled(args.profile, 'customers', recorded('customers', args.context, main(
+        args.context, args.sendTxns, args.enableLogging, args.locale, args.export, args.exportFormat, args.count, args.batchSize)))
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
@@ -4,14 +4,27 @@ import argparse
 import logging
 import random
 import asyncio
-from pymongo import MongoClient, UpdateOne
+import time
 from datetime import datetime, timezone
-from dotenv import load_dotenv
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
-from send_transactions import send_transactions
+from send_transactions import send_transactions, send_transaction, generate_transactions
+from sampling import SAMPLING_STRATEGIES, sample_collection
+from async_mongo import connect_async
+from targets import TARGETS, ensure_user_indexes, target_query, uses_collection_scan
+from metrics import metrics, current_context
+from status_server import start_status_server
+from concurrency import set_ceiling, unbounded_connector
+from http_policy import set_gzip, set_response_mode
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
+
+# Fields read for each customer that may receive a transaction
+CUSTOMER_PROJECTION = {'_id': 0, 'user_id': 1, 'external_id': 1, 'persona': 1}
 
 # Load and define environment variables based on argument
 def load_environment_variables(context):
+    from dotenv import load_dotenv
     # Specify the path to the .env file in the root directory
     env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
     load_dotenv(dotenv_path=env_path)
@@ -40,20 +53,57 @@ def setup_logging():
     logger = logging.getLogger(__name__)
     return logger
 
-# MongoDB connection setup
+# MongoDB connection setup; collection calls are awaited and run off the event loop
 def connect_mongo(mongo_uri, mongo_db_name):
-    client = MongoClient(mongo_uri)
-    db = client[mongo_db_name]
-    return db
+    return connect_async(mongo_uri, mongo_db_name)
+
+# Generate one transaction per sampled user and write them to files for the replay command
+def export_transactions(context, env_vars, sample_users, export_dir, export_format):
+    from export import DatasetWriter, write_manifest
+
+    writer = DatasetWriter(export_dir, 'transactions', export_format)
+    for batch_start in range(0, len(sample_users), writer.batch_size):
+        batch_users = sample_users[batch_start:batch_start + writer.batch_size]
+        external_ids = batch_users.external_ids()
+        batch = generate_transactions(external_ids, context, env_vars, batch_users.personas)
+        writer.write([
+            {"external_id": external_id,
+             "open_time": transaction_data["request_payload"]["open_time"],
+             "total": transaction_data["request_payload"]["payments"][0]["amount"],
+             "payload": transaction_data}
+            for external_id, transaction_data in zip(external_ids, batch)
+        ])
+    summary = writer.close()
+    write_manifest(export_dir, context, {'transactions': summary})
+    print(f"Exported {summary['records']} transactions to {export_dir} ({summary['parts']} {summary['format']} files)")
+
+# Build the query for the customers a run may target, after making sure the indexes behind it exist
+async def select_targets(collection, target, inactive_days, logger):
+    await collection.run(ensure_user_indexes)
+    query = await collection.run(target_query, target, inactive_days)
+    if target != 'all' and await collection.run(uses_collection_scan, query, CUSTOMER_PROJECTION):
+        logger.warning(f"The {target} target query is scanning the whole collection")
+        print(f"Warning: the {target} target query is scanning the whole collection; check the indexes in targets.py")
+    return query
 
-# Function to fetch data based on context
-def fetch_data(collection_name, db):
-    collection = db[collection_name]
-    data = collection.find().sort("timestamp", -1)  # Sort by timestamp in descending order
-    return [{'user_id': doc['user_id'], 'timestamp': doc['timestamp'], 'external_id': doc['external_id']} for doc in data if 'external_id' in doc]
+def size_label(target):
+    return "Total collection size" if target == 'all' else f"Targeted customers ({target})"
+
+# Updates that $set lasttxn_timestamp on the users at rows of a population after a transaction is sent to them,
+# plus the persona of rows in the new_personas mask
+def txn_updates(users, rows, lasttxn_timestamp, new_personas):
+    from pymongo import UpdateOne
+    return [
+        UpdateOne({'user_id': user_id}, {'$set': {'lasttxn_timestamp': lasttxn_timestamp,
+                                                  **({'persona': users.persona(row)} if new_personas[row] else {})}})
+        for row, user_id in zip(rows.tolist(), users[rows].user_ids())
+    ]
 
 # Main function to orchestrate fetching data and sending transactions
-async def randomize_transactions(context, enable_logging):
+async def randomize_transactions(context, enable_logging, sampling='uniform', export_dir=None, export_format='ndjson',
+                                 target='all', inactive_days=30):
+    import numpy as np
+
     # Load environment variables
     env_vars = load_environment_variables(context)
 
@@ -67,41 +117,160 @@ async def randomize_transactions(context, enable_logging):
     # Connect to MongoDB
     db = connect_mongo(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
 
-    # Fetch data
-    data = fetch_data(env_vars['MONGO_COLLECTION_NAME'], db)
-    total_collection_size = len(data)
+    # Count the customers this run targets
+    collection = db[env_vars['MONGO_COLLECTION_NAME']]
+    query = await select_targets(collection, target, inactive_days, logger)
+    total_collection_size = await collection.count_documents(query)
 
     # ------------------------ VERY IMPORTANT SAMPLE SETTING  ---------------------------
     # Define the sample percentage
     sample_percentage = random.uniform(0.1, 0.4)
 
-    # Retain only a percentage of the total collection
+    # Retain only a percentage of the total collection; every sampled user gets one transaction
     sample_size = int(total_collection_size * sample_percentage)
-    sample_users = data[:sample_size]
-    sample_external_ids = [doc['external_id'] for doc in sample_users]
+    sample_users = await collection.run(sample_collection, sampling, sample_size, query=query, projection=CUSTOMER_PROJECTION,
+                                        context=context)
+    new_personas = sample_users.fill_missing_personas(context)
+    sample_external_ids = sample_users.external_ids()
 
-    # Send transactions
-    await send_transactions(sample_external_ids, context, enable_logging)
+    # Write the transactions to files instead of sending them; Mongo is left untouched
+    if export_dir:
+        export_transactions(context, env_vars, sample_users, export_dir, export_format)
+        print(f"{size_label(target)}: {total_collection_size}")
+        return
 
-    # Update sampled users in MongoDB with the last transaction timestamp
+    # Update sampled users in MongoDB with the last transaction timestamp (and any newly assigned persona)
+    # while their transactions are being sent
     lasttxn_timestamp = datetime.now(timezone.utc).isoformat()
-    updates = [
-        UpdateOne({'user_id': user['user_id']}, {'$set': {'lasttxn_timestamp': lasttxn_timestamp}})
-        for user in sample_users
-    ]
-    db[env_vars['MONGO_COLLECTION_NAME']].bulk_write(updates)
+    updates = txn_updates(sample_users, np.arange(len(sample_users)), lasttxn_timestamp, new_personas)
+    pending = [send_transactions(sample_external_ids, context, enable_logging, personas=sample_users.personas)]
+    if updates:
+        pending.append(collection.bulk_write(updates))
+    await asyncio.gather(*pending)
 
     # Print the total collection size and number of transactions sent
-    print(f"Total collection size: {total_collection_size}")
-    print(f"Number of transactions sent: {sample_size}")
+    print(f"{size_label(target)}: {total_collection_size}")
+    print(f"Number of transactions sent: {len(sample_external_ids)}")
 
-if __name__ == '__main__':
-    # Setup argument parser
-    parser = argparse.ArgumentParser(description='Generate and send random transactions.')
+# Long-running mode: spread a target daily volume over time following the context's diurnal curve
+async def shape_transactions(context, enable_logging, sampling, daily_volume, duration_hours, utc_offset, target='all',
+                             inactive_days=30, window_seconds=300):
+    import aiohttp
+    import numpy as np
+    from traffic import generate_arrivals, expected_volume
+
+    env_vars = load_environment_variables(context)
+    current_context.set(context)
+    if enable_logging:
+        logger = setup_logging()
+    else:
+        logger = logging.getLogger(__name__)
+        logger.addHandler(logging.NullHandler())
+
+    # Sample the pool of customers that arrivals are drawn from
+    db = connect_mongo(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
+    collection = db[env_vars['MONGO_COLLECTION_NAME']]
+    query = await select_targets(collection, target, inactive_days, logger)
+    total_collection_size = await collection.count_documents(query)
+    sample_size = int(total_collection_size * random.uniform(0.1, 0.4))
+    pool = await collection.run(sample_collection, sampling, sample_size, query=query, projection=CUSTOMER_PROJECTION,
+                                context=context)
+    if not len(pool):
+        print(f"No customers to send transactions to (collection size: {total_collection_size})")
+        return
+    new_personas = pool.fill_missing_personas(context)
+
+    rng = np.random.default_rng()
+    start = time.time()
+    end = start + duration_hours * 3600
+    print(f"Shaping ~{expected_volume(context, daily_volume, start, end - start, utc_offset):.0f} transactions "
+          f"over {duration_hours}h across {len(pool)} customers")
+
+    counts = {"sent": 0, "success": 0, "failed": 0}
+
+    # The transactions limiter (see run) caps how many are in flight
+    async def dispatch(session, transaction_data):
+        result = await send_transaction(session, transaction_data, env_vars['AUTH_TOKEN'], env_vars['CLOUDPOS_ENDPOINT'], logger)
+        counts["sent"] += 1
+        counts["success" if result["status"] == 200 else "failed"] += 1
+
+    # Each window's Mongo write runs in the background while the next window is sent
+    pending_write = None
+    async with aiohttp.ClientSession(connector=unbounded_connector()) as session:
+        window_start = start
+        while window_start < end:
+            # Generate the next window of arrivals ahead of time in one vectorized batch
+            window = min(window_seconds, end - window_start)
+            arrivals = generate_arrivals(context, daily_volume, window_start, window, utc_offset, rng)
+            picks = rng.integers(len(pool), size=len(arrivals))
+            users = pool[picks]
+            # Each transaction is stamped with its scheduled arrival, not the moment it is built
+            transactions = generate_transactions(users.external_ids(), context, env_vars, users.personas, rng, timestamps=arrivals)
+            metrics.plan("transactions", len(transactions))
+
+            tasks = []
+            for arrival, transaction_data in zip(arrivals.tolist(), transactions):
+                delay = arrival - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(dispatch(session, transaction_data)))
+            await asyncio.gather(*tasks)
+
+            # Record the customers that transacted in this window
+            lasttxn_timestamp = datetime.now(timezone.utc).isoformat()
+            window_rows = np.unique(picks)
+            if len(window_rows):
+                if pending_write:
+                    await pending_write
+                pending_write = asyncio.create_task(collection.bulk_write(
+                    txn_updates(pool, window_rows, lasttxn_timestamp, new_personas)))
+                new_personas[window_rows] = False
+
+            print(f"{datetime.now(timezone.utc).isoformat()} - window sent: {len(arrivals)}, "
+                  f"total sent: {counts['sent']}, success: {counts['success']}, failed: {counts['failed']}")
+            window_start += window
+
+    if pending_write:
+        await pending_write
+    print(f"{size_label(target)}: {total_collection_size}")
+    print(f"Number of transactions sent: {counts['sent']}")
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Generate and send random transactions.')
     parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
     parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
+    parser.add_argument('--sampling', choices=SAMPLING_STRATEGIES, default='uniform', help='Strategy used to pick the sampled customers.')
+    parser.add_argument('--target', choices=TARGETS, default='all',
+                        help='Customers to sample from: all, inactive (no transaction in --inactiveDays) or last-run (created by the latest run).')
+    parser.add_argument('--inactiveDays', type=int, default=30, help='Days without a transaction for the inactive target.')
+    parser.add_argument('--shape', action='store_true', help='Run continuously, spreading --dailyVolume over a diurnal curve instead of sending one burst.')
+    parser.add_argument('--dailyVolume', type=int, default=10000, help='Target transactions per day when shaping traffic.')
+    parser.add_argument('--durationHours', type=float, default=24.0, help='How long to shape traffic for.')
+    parser.add_argument('--utcOffset', type=float, default=0.0, help='Offset from UTC, in hours, of the stores the diurnal curve describes.')
+    parser.add_argument('--maxInFlight', type=int, default=50, help='Maximum concurrent requests. Concurrency adapts below this from observed latency and errors.')
+    parser.add_argument('--export', metavar='DIR', help='Write the sampled transactions to files in DIR instead of sending them.')
+    parser.add_argument('--exportFormat', choices=['ndjson', 'parquet'], default='ndjson', help='File format for --export.')
+    add_run_options(parser, progress='while transactions are sent', responses='transaction')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    set_ceiling(args.maxInFlight, 'transactions')
+    set_response_mode(args.responses, args.enableLogging, 'transactions')
+    set_gzip(args.gzipRequests, 'transactions')
+    if args.shape:
+        # Shaped runs are paced by the diurnal curve, so they are compared with each other rather than with bursts
+        return profiled(args.profile, 'txns', recorded('txns-shape', args.context, shape_transactions(
+            args.context, args.enableLogging, args.sampling, args.dailyVolume, args.durationHours, args.utcOffset, args.target,
+            args.inactiveDays)))
+    return profiled(args.profile, 'txns', recorded('txns', args.context, randomize_transactions(
+        args.context, args.enableLogging, args.sampling, args.export, args.exportFormat, args.target, args.inactiveDays)))
 
-    args = parser.parse_args()
+if __name__ == '__main__':
+    args = build_parser().parse_args()
 
     # Run the main function
-    asyncio.run(randomize_transactions(args.context, args.enableLogging))
+    asyncio.run(run(args))
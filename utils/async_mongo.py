@@ -0,0 +1,76 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from profiling import profiler
+
+# Threads that run pymongo calls for the event loop; pymongo clients are thread-safe and pool their own connections
+MONGO_THREADS = 4
+
+_executor = None
+_clients = {}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MONGO_THREADS, thread_name_prefix='mongo')
+    return _executor
+
+# Run a blocking call on the Mongo executor so the event loop keeps serving HTTP requests meanwhile
+# With --profile the call is timed as the persist stage on the executor thread
+async def run_in_executor(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    call = functools.partial(fn, *args, **kwargs)
+    if profiler.enabled:
+        call = profiler.staged("persist")(call)
+    return await loop.run_in_executor(_get_executor(), call)
+
+# Async wrapper around a pymongo collection; each method runs the pymongo call of the same name off the event loop
+class AsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def count_documents(self, *args, **kwargs):
+        return await run_in_executor(self.collection.count_documents, *args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await run_in_executor(self.collection.find_one, *args, **kwargs)
+
+    # Cursors are drained in the executor thread; pass a projection to keep the documents small
+    async def find(self, *args, **kwargs):
+        return await run_in_executor(lambda: list(self.collection.find(*args, **kwargs)))
+
+    async def aggregate(self, *args, **kwargs):
+        return await run_in_executor(lambda: list(self.collection.aggregate(*args, **kwargs)))
+
+    async def insert_many(self, *args, **kwargs):
+        return await run_in_executor(self.collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await run_in_executor(self.collection.update_one, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await run_in_executor(self.collection.bulk_write, *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return await run_in_executor(self.collection.create_index, *args, **kwargs)
+
+    # Run a synchronous helper that takes the pymongo collection first (e.g. sampling.sample_collection)
+    async def run(self, fn, *args, **kwargs):
+        return await run_in_executor(fn, self.collection, *args, **kwargs)
+
+class AsyncDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.db[name])
+
+# MongoDB connection setup; one client per URI is shared by every script run in the process
+def connect_async(mongo_uri, mongo_db_name):
+    from pymongo import MongoClient
+    if mongo_uri not in _clients:
+        _clients[mongo_uri] = MongoClient(mongo_uri)
+    return AsyncDatabase(_clients[mongo_uri][mongo_db_name])
@@ -0,0 +1,105 @@
+import os
+import csv
+import numpy as np
+
+CATALOG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'catalogs'))
+
+# Sales tax applied to each basket (fuel prices are posted tax-inclusive)
+TAX_RATES = {'retail': 0.0725, 'qsr': 0.0825, 'fuel': 0.0}
+
+# Share of baskets that get a promotional discount, and its size
+DISCOUNT_RATE = 0.15
+DISCOUNT_PERCENT = 0.10
+
+# Most units of a single "each" item on one line
+MAX_LINE_QUANTITY = 4
+
+# Weighted candidates drawn per line; the one priced closest to the line's share of the spend is kept
+CANDIDATES_PER_LINE = 3
+
+# Product catalog held as parallel arrays: one entry per product, no per-product objects
+class Catalog:
+    def __init__(self, context, item_ids, prices, category_codes, categories, by_weight, weights):
+        self.context = context
+        self.item_ids = item_ids
+        self.prices = prices
+        self.category_codes = category_codes
+        self.categories = categories
+        self.by_weight = by_weight
+        self.cumulative_weights = np.cumsum(weights / weights.sum())
+        self.tax_rate = TAX_RATES.get(context, 0.0)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    # Pick items for many baskets at once by weighted (inverse-CDF) sampling
+    # amounts are each basket's target spend; it is split across the basket's lines to pick items and quantities
+    def sample_baskets(self, amounts, basket_sizes, rng=None):
+        rng = rng or np.random.default_rng()
+        amounts = np.asarray(amounts, dtype=np.float64)
+        basket_sizes = np.asarray(basket_sizes, dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(basket_sizes)))
+        total_lines = int(offsets[-1])
+
+        # Each line gets an equal share of the basket's target spend
+        line_share = np.repeat(amounts / np.maximum(basket_sizes, 1), basket_sizes)
+
+        # Draw weighted candidates for every line and keep the one whose price best fits the line's share
+        candidates = np.searchsorted(self.cumulative_weights, rng.random((total_lines, CANDIDATES_PER_LINE)), side='right')
+        candidates = np.minimum(candidates, len(self.item_ids) - 1)
+        best = np.abs(self.prices[candidates] - line_share[:, None]).argmin(axis=1)
+        items = candidates[np.arange(total_lines), best]
+        unit_prices = self.prices[items]
+
+        by_weight = self.by_weight[items]
+        quantities = np.where(
+            by_weight,
+            np.round(np.maximum(line_share / unit_prices, 1.0), 3),
+            np.clip(np.rint(line_share / unit_prices), 1, MAX_LINE_QUANTITY)
+        )
+        line_subtotals = np.round(unit_prices * quantities, 2)
+
+        # Basket totals (reduceat needs at least one line per basket, which basket_sizes >= 1 guarantees)
+        subtotals = np.round(np.add.reduceat(line_subtotals, offsets[:-1]), 2) if total_lines else np.zeros(len(amounts))
+        discounts = np.where(rng.random(len(amounts)) < DISCOUNT_RATE, np.round(subtotals * DISCOUNT_PERCENT, 2), 0.0)
+        taxes = np.round((subtotals - discounts) * self.tax_rate, 2)
+        totals = np.round(subtotals - discounts + taxes, 2)
+
+        return {
+            'offsets': offsets.tolist(),
+            'item_ids': self.item_ids[items].tolist(),
+            'quantities': [int(q) if not w else q for q, w in zip(quantities.tolist(), by_weight.tolist())],
+            'unit_prices': unit_prices.tolist(),
+            'line_subtotals': line_subtotals.tolist(),
+            'subtotal': subtotals.tolist(),
+            'discount': discounts.tolist(),
+            'tax': taxes.tolist(),
+            'total': totals.tolist(),
+        }
+
+_catalogs = {}
+
+# Load (once per process) the catalog file for a context into a Catalog
+def load_catalog(context):
+    if context in _catalogs:
+        return _catalogs[context]
+
+    with open(os.path.join(CATALOG_DIR, f'{context}.csv'), newline='') as file:
+        rows = list(csv.DictReader(file))
+    if not rows:
+        raise ValueError(f"Catalog for context {context} is empty.")
+
+    categories = sorted({row['category'] for row in rows})
+    category_index = {category: code for code, category in enumerate(categories)}
+    catalog = Catalog(
+        context,
+        item_ids=np.array([row['item_id'] for row in rows]),
+        prices=np.array([float(row['price']) for row in rows], dtype=np.float64),
+        category_codes=np.array([category_index[row['category']] for row in rows], dtype=np.int16),
+        categories=categories,
+        by_weight=np.array([row['unit'] != 'each' for row in rows]),
+        weights=np.array([float(row['weight']) for row in rows], dtype=np.float64),
+    )
+
+    _catalogs[context] = catalog
+    return catalog
@@ -0,0 +1,169 @@
+import time
+import asyncio
+from collections import deque
+from metrics import metrics
+from profiling import profiler
+
+# Upper bound on in-flight requests per endpoint unless a script's --maxInFlight sets one (aiohttp's default connection limit)
+DEFAULT_CEILING = 100
+
+# Limit a new limiter starts from before slow start finds the endpoint's capacity
+INITIAL_LIMIT = 4
+
+# Vegas thresholds: estimated requests queued at the server below ALPHA grow the limit, above BETA shrink it
+ALPHA = 3
+BETA = 6
+
+# Factor the limit is cut by on an overload signal (at most once per round trip)
+BACKOFF = 0.5
+
+# Weight of each new sample in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+# The baseline (minimum) latency is re-measured this often, so it follows the endpoint if it gets slower for good
+BASELINE_RESET_SECONDS = 30
+
+# Connection errors, 429 and 5xx mean the endpoint is overloaded; other 4xx statuses are about the request, not the load
+def is_overload(status):
+    return status == "error" or status == 429 or status >= 500
+
+# Adaptive cap on concurrent requests to one endpoint, tuned from each response's latency and status
+# Starts with slow start (the limit grows by one per success, doubling every round trip) until latency shows
+# requests queueing at the server, then follows TCP Vegas: the requests queued at the server are estimated as
+# limit * (1 - baseline latency / smoothed latency), and the limit moves by one request per round trip to keep
+# that between ALPHA and BETA. Errors, 429s and 5xx halve the limit (AIMD). The limit never exceeds the ceiling.
+class AdaptiveLimiter:
+    def __init__(self, ceiling=DEFAULT_CEILING, min_limit=1):
+        self.ceiling = ceiling
+        self.min_limit = min_limit
+        self.limit = float(min(INITIAL_LIMIT, ceiling))
+        self.in_flight = 0
+        self.slow_start = True
+        self.smoothed_latency = None
+        self.baseline_latency = None
+        self.baseline_reset_at = time.monotonic() + BASELINE_RESET_SECONDS
+        self.last_backoff = 0.0
+        self._waiters = deque()
+
+    def set_ceiling(self, ceiling):
+        if ceiling < 1:
+            raise ValueError(f"A concurrency ceiling must be at least 1, got {ceiling}.")
+        self.ceiling = ceiling
+        self.limit = min(self.limit, ceiling)
+
+    # Wait for a free slot under the current limit
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass a wake-up this waiter received on to the next one
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    # Free the slot taken by acquire() and adjust the limit from the response
+    def release(self, status, latency):
+        self.in_flight -= 1
+        self._observe(status, latency)
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _observe(self, status, latency):
+        now = time.monotonic()
+        if is_overload(status):
+            # One cut per round trip, so a burst of failures from the same window is one signal
+            if now - self.last_backoff > (self.smoothed_latency or latency):
+                self.limit = max(self.min_limit, self.limit * BACKOFF)
+                self.last_backoff = now
+                self.slow_start = False
+            return
+
+        self.smoothed_latency = latency if self.smoothed_latency is None else \
+            (1 - LATENCY_SMOOTHING) * self.smoothed_latency + LATENCY_SMOOTHING * latency
+        if self.baseline_latency is None or latency < self.baseline_latency or now >= self.baseline_reset_at:
+            if now >= self.baseline_reset_at:
+                self.baseline_reset_at = now + BASELINE_RESET_SECONDS
+            self.baseline_latency = latency
+
+        queued = self.limit * (1 - self.baseline_latency / max(self.smoothed_latency, 1e-9))
+        if self.slow_start:
+            if queued > BETA:
+                self.slow_start = False
+            else:
+                self.limit += 1
+        elif queued < ALPHA:
+            self.limit += 1 / self.limit
+        elif queued > BETA:
+            self.limit -= 1 / self.limit
+        self.limit = min(self.ceiling, max(self.min_limit, self.limit))
+
+    def state(self):
+        return {'limit': int(self.limit), 'in_flight': self.in_flight, 'ceiling': self.ceiling,
+                'latency_ms': round(self.smoothed_latency * 1000, 1) if self.smoothed_latency is not None else None}
+
+_limiters = {}
+
+# The process-wide limiter for a kind of request ("customers", "transactions", "profile_updates"), shared by every
+# script and job in the process that sends to that endpoint
+def limiter_for(kind):
+    limiter = _limiters.get(kind)
+    if limiter is None:
+        limiter = _limiters[kind] = AdaptiveLimiter()
+    return limiter
+
+# Cap the limiters for these kinds of request at a script's --maxInFlight
+def set_ceiling(max_in_flight, *kinds):
+    if max_in_flight < 1:
+        raise ValueError("--maxInFlight must be at least 1.")
+    for kind in kinds:
+        limiter_for(kind).set_ceiling(max_in_flight)
+
+# Connection pool for a sending session; it is unbounded because the limiters above already cap requests in flight,
+# and a pool limit would only queue requests where neither the limiters nor the metrics see them
+def unbounded_connector():
+    import aiohttp
+    return aiohttp.TCPConnector(limit=0)
+
+def limiter_states():
+    return {kind: limiter.state() for kind, limiter in list(_limiters.items())}
+
+# One request sent under its kind's limiter and recorded in the metrics (and, with --profile, the send stage);
+# set .status once the response arrives
+# The latency recorded excludes the wait for a slot, which shows up as queue depth instead
+class TrackedRequest:
+    def __init__(self, kind):
+        self.kind = kind
+        self.limiter = limiter_for(kind)
+        self.status = "error"
+
+    async def __aenter__(self):
+        metrics.start()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            metrics.abandon()
+            raise
+        self.started = time.perf_counter()
+        self.profiled = profiler.enabled
+        if self.profiled:
+            profiler.begin("send", self.started)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        ended = time.perf_counter()
+        latency = ended - self.started
+        if self.profiled:
+            profiler.end("send", ended, latency)
+        self.limiter.release(self.status, latency)
+        metrics.record(self.kind, self.status, latency)
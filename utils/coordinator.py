@@ -0,0 +1,79 @@
+import sys
+import os
+import argparse
+import asyncio
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from job_queue import (CHUNKS_COLLECTION, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, connect_mongo, ensure_indexes, create_run,
+                       run_status)
+from targets import new_run_id
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
+
+# Load and define environment variables based on argument
+def load_environment_variables(context):
+    from dotenv import load_dotenv
+    # Specify the path to the .env file in the root directory
+    env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+    load_dotenv(dotenv_path=env_path)
+    env_vars = {
+        'MONGO_URI': os.getenv(f'{context.upper()}_MONGO_URI'),
+        'MONGO_DB_NAME': os.getenv(f'{context.upper()}_MONGO_DB_NAME')
+    }
+
+    for key, value in env_vars.items():
+        if not value:
+            raise ValueError(f"Essential environment variable {key} is not set for context {context}.")
+
+    return env_vars
+
+def print_status(status):
+    chunks = status['chunks']
+    print(f"Run {status['run_id']}: " + ", ".join(f"{name}: {count}" for name, count in chunks.items()))
+    for key, value in status['results'].items():
+        print(f"  {key}: {value}")
+
+# Main function: split a customer generation run into chunks for workers, or report on an existing run
+async def coordinate(context, customers, chunk_size, locale, send_txns, run_id, status_only):
+    env_vars = load_environment_variables(context)
+    db = connect_mongo(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])
+    chunks = db[CHUNKS_COLLECTION]
+
+    if status_only:
+        print_status(run_status(chunks, run_id))
+        return
+
+    ensure_indexes(chunks)
+    run_id = run_id or new_run_id(context)
+    count = create_run(chunks, run_id, 'customers', context, customers, chunk_size, {'locale': locale, 'send_txns': send_txns})
+    print(f"Created run {run_id}: {customers} customers in {count} chunks of up to {chunk_size}")
+    print(f"Start workers with: python cli.py worker --context {context} --runId {run_id}")
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Split a customer generation run into chunks that workers share through MongoDB.')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
+    parser.add_argument('--customers', type=int, help='Total number of customers to generate across all workers.')
+    parser.add_argument('--chunkSize', type=int, default=DEFAULT_CHUNK_SIZE, help=f'Customers per chunk (max {MAX_CHUNK_SIZE}).')
+    parser.add_argument('--locale', choices=['en_US', 'es_MX', 'pt_PT'], default='en_US', help='Locale passed to generate_customers.py.')
+    parser.add_argument('--sendTxns', action='store_true', help='Send first transactions for each chunk.')
+    parser.add_argument('--runId', help='Id for the run (defaults to <context>-<UTC timestamp>).')
+    parser.add_argument('--status', action='store_true', help='Print the progress of --runId instead of creating a run.')
+    add_run_options(parser)
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.status:
+        if not args.runId:
+            raise ValueError("--status requires --runId.")
+    elif not args.customers or args.customers < 1:
+        raise ValueError("--customers is required to create a run.")
+    if not 1 <= args.chunkSize <= MAX_CHUNK_SIZE:
+        raise ValueError(f"--chunkSize must be between 1 and {MAX_CHUNK_SIZE}.")
+    return profiled(args.profile, 'coordinator', recorded('coordinator', args.context, coordinate(
+        args.context, args.customers, args.chunkSize, args.locale, args.sendTxns, args.runId, args.status)))
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,89 @@
+import os
+import json
+import glob
+from datetime import datetime, timezone
+
+EXPORT_FORMATS = ['ndjson', 'parquet']
+
+# Records written per part file
+DEFAULT_BATCH_SIZE = 10000
+
+# Columns holding nested objects; Parquet stores them as JSON strings
+JSON_COLUMNS = ('payload', 'persona')
+
+MANIFEST_NAME = 'manifest.json'
+
+# Write generated records to fixed-size part files (<name>-00000.ndjson / .parquet) without sending them
+class DatasetWriter:
+    def __init__(self, directory, name, fmt='ndjson', batch_size=DEFAULT_BATCH_SIZE):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.buffer = []
+        self.parts = 0
+        self.records = 0
+
+    def write(self, records):
+        for record in records:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        path = os.path.join(self.directory, f"{self.name}-{self.parts:05d}.{self.fmt}")
+        if self.fmt == 'ndjson':
+            with open(path, 'w') as file:
+                file.writelines(json.dumps(record, default=str) + '\n' for record in self.buffer)
+        else:
+            import pandas as pd
+            frame = pd.DataFrame(self.buffer)
+            for column in JSON_COLUMNS:
+                if column in frame:
+                    frame[column] = [json.dumps(value, default=str) for value in frame[column]]
+            frame.to_parquet(path, index=False)
+        self.parts += 1
+        self.records += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        return {'format': self.fmt, 'parts': self.parts, 'records': self.records}
+
+# Record what was exported so replay knows the context and formats
+def write_manifest(directory, context, datasets):
+    manifest = {
+        'context': context,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'datasets': datasets,
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+# Stream a dataset back one part file at a time, yielding lists of records
+def read_dataset(directory, name):
+    paths = sorted(glob.glob(os.path.join(directory, f"{name}-*.ndjson")) + glob.glob(os.path.join(directory, f"{name}-*.parquet")))
+    for path in paths:
+        if path.endswith('.ndjson'):
+            with open(path) as file:
+                yield [json.loads(line) for line in file if line.strip()]
+        else:
+            import pandas as pd
+            frame = pd.read_parquet(path)
+            for column in JSON_COLUMNS:
+                if column in frame:
+                    frame[column] = [json.loads(value) for value in frame[column]]
+            yield frame.to_dict('records')
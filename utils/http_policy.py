@@ -0,0 +1,56 @@
+import gzip
+import json
+
+# How much of a response a sender keeps:
+# 'status' - only the status; the body is drained off the connection (so it can be reused) without being decoded
+# 'headers' - the status and the response headers
+# 'body' - the status and the decoded body text
+RESPONSE_MODES = ('status', 'headers', 'body')
+
+# Response mode per kind of request. CloudPOS and user_profile updates return nothing useful beyond the status;
+# created customers are read back from the users API's response, so their bodies are always kept
+DEFAULT_RESPONSE_MODES = {"transactions": "status", "profile_updates": "status", "customers": "body"}
+
+# Fast compression level; the JSON bodies are small and repetitive, so higher levels barely shrink them further
+GZIP_LEVEL = 1
+
+# Bodies smaller than this are sent uncompressed, as gzip's header and CPU cost outweigh the saving
+GZIP_MIN_BYTES = 512
+
+_response_modes = dict(DEFAULT_RESPONSE_MODES)
+_gzip_kinds = set()
+
+# Apply a script's --responses to these kinds of request; runs with --enableLogging keep bodies unless told otherwise,
+# and kinds without a setting go back to their default (so one scheduled job's flags do not leak into the next)
+def set_response_mode(mode, enable_logging, *kinds):
+    for kind in kinds:
+        _response_modes[kind] = mode or ('body' if enable_logging else DEFAULT_RESPONSE_MODES.get(kind, 'body'))
+
+def response_mode(kind):
+    return _response_modes.get(kind, 'body')
+
+# Gzip the request bodies of these kinds of request (--gzipRequests); the API must accept Content-Encoding: gzip
+def set_gzip(enabled, *kinds):
+    for kind in kinds:
+        if enabled:
+            _gzip_kinds.add(kind)
+        else:
+            _gzip_kinds.discard(kind)
+
+# JSON-encode a request body, gzipped when enabled for its kind; returns the body and any headers it needs
+def encode_body(kind, payload):
+    body = json.dumps(payload).encode()
+    if kind in _gzip_kinds and len(body) >= GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), {'Content-Encoding': 'gzip'}
+    return body, {}
+
+# Read as much of a response as its kind's mode keeps: None, a dict of headers or the body text
+async def read_response(kind, response):
+    mode = response_mode(kind)
+    if mode == 'body':
+        return await response.text()
+    while await response.content.readany():
+        pass
+    if mode == 'headers':
+        return dict(response.headers)
+    return None
@@ -0,0 +1,83 @@
+import time
+import uuid
+import hashlib
+
+# Namespace for deterministic ids; the same run and position always produce the same id
+ID_NAMESPACE = uuid.UUID('6f1c2b9e-4d0a-5b7e-9c3f-2a8d1e4b7c60')
+
+# A process keeps its membership cache this long before warming it again from MongoDB
+CACHE_MAX_AGE_SECONDS = 3600
+
+# Deterministic UUID for a position in a run (e.g. a customer's external_id), so a retried run reuses its ids
+def deterministic_id(*parts):
+    return str(uuid.uuid5(ID_NAMESPACE, ':'.join(str(part) for part in parts)))
+
+# Stable 64-bit seed for a numpy Generator, so a retried unit of work draws the same values
+def stable_seed(*parts):
+    return int.from_bytes(hashlib.blake2b(':'.join(str(part) for part in parts).encode(), digest_size=8).digest(), 'big')
+
+def _hash_array(values):
+    import numpy as np
+    return np.unique(np.fromiter((hash(value) for value in values), dtype=np.int64))
+
+# Which external_ids and emails already exist, held as sorted arrays of 64-bit hashes rather than sets of strings
+# Hashes use Python's per-process hash(), so a cache is only valid in the process that built it
+class MembershipCache:
+    def __init__(self, external_ids=(), emails=()):
+        self.external_ids = _hash_array(external_ids)
+        self.emails = _hash_array(email.lower() for email in emails)
+        self.added = set()
+        self.created_at = time.time()
+
+    def __len__(self):
+        return len(self.external_ids) + len(self.added)
+
+    @staticmethod
+    def _contains(array, value):
+        import numpy as np
+        index = np.searchsorted(array, value)
+        return index < len(array) and array[index] == value
+
+    def seen(self, external_id=None, email=None):
+        if external_id is not None:
+            key = hash(external_id)
+            if ('external_id', key) in self.added or self._contains(self.external_ids, key):
+                return True
+        if email is not None:
+            key = hash(email.lower())
+            if ('email', key) in self.added or self._contains(self.emails, key):
+                return True
+        return False
+
+    def add(self, external_id=None, email=None):
+        if external_id is not None:
+            self.added.add(('external_id', hash(external_id)))
+        if email is not None:
+            self.added.add(('email', hash(email.lower())))
+
+    # Warm a cache from every customer in one projected query
+    @classmethod
+    def from_collection(cls, collection):
+        external_ids, emails = [], []
+        for doc in collection.find({}, {'_id': 0, 'external_id': 1, 'email': 1}, batch_size=10000):
+            if doc.get('external_id'):
+                external_ids.append(doc['external_id'])
+            if doc.get('email'):
+                emails.append(doc['email'])
+        return cls(external_ids, emails)
+
+# Add the customers among external_ids that already exist in MongoDB to a cache, whatever its age
+# (e.g. for a chunk reclaimed from another worker, whose inserts this process's cache has not seen)
+def recheck_external_ids(collection, cache, external_ids):
+    for doc in collection.find({'external_id': {'$in': list(external_ids)}}, {'_id': 0, 'external_id': 1, 'email': 1}):
+        cache.add(doc.get('external_id'), doc.get('email'))
+
+_caches = {}
+
+# The process-wide membership cache for a customer collection, warmed on first use and again once it is stale
+def membership_cache(collection):
+    key = (id(collection.database.client), collection.full_name)
+    cache = _caches.get(key)
+    if cache is None or time.time() - cache.created_at > CACHE_MAX_AGE_SECONDS:
+        cache = _caches[key] = MembershipCache.from_collection(collection)
+    return cache
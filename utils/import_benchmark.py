@@ -0,0 +1,58 @@
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules that must not be imported just to load a subcommand
+HEAVY_MODULES = ['aiohttp', 'pymongo', 'faker', 'dotenv', 'numpy', 'pandas', 'flask', 'apscheduler']
+
+# Runs in a fresh interpreter: load the CLI and a subcommand's parser, report time and heavy imports
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import cli
+cli.load_command({command!r}).build_parser()
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"elapsed_ms": elapsed_ms, "heavy": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+# Measure one subcommand, keeping the fastest of several fresh-interpreter runs
+def measure_command(command, repeat):
+    best = None
+    for _ in range(repeat):
+        code = PROBE.format(root=ROOT_DIR, command=command, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['elapsed_ms'] < best['elapsed_ms']:
+            best = result
+    return best
+
+def main():
+    sys.path.insert(0, ROOT_DIR)
+    import cli
+
+    parser = argparse.ArgumentParser(description='Guard CLI startup time: fail if a subcommand loads heavy modules or exceeds the budget.')
+    parser.add_argument('--budgetMs', type=float, default=150.0, help='Maximum time to load a subcommand, in milliseconds.')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh-interpreter runs per subcommand (the fastest is kept).')
+    args = parser.parse_args()
+
+    failures = 0
+    for command in cli.COMMANDS:
+        result = measure_command(command, args.repeat)
+        status = 'ok'
+        if result['heavy']:
+            status = f"FAIL imports {', '.join(result['heavy'])}"
+        elif result['elapsed_ms'] > args.budgetMs:
+            status = f"FAIL over {args.budgetMs:.0f}ms budget"
+        if status != 'ok':
+            failures += 1
+        print(f"{command:<12}{result['elapsed_ms']:8.1f} ms  {status}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
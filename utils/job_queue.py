@@ -0,0 +1,129 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# Collection (in the context's database) holding one document per chunk of a distributed run
+CHUNKS_COLLECTION = 'job_chunks'
+
+# Largest chunk a worker sends at once; matches the max in generate_customers
+MAX_CHUNK_SIZE = 500
+DEFAULT_CHUNK_SIZE = 250
+
+# A worker renews its lease while running a chunk; a lease that is not renewed in time is reclaimed
+DEFAULT_LEASE_SECONDS = 600
+
+# Claims per chunk before it is marked failed instead of being reclaimed again
+MAX_ATTEMPTS = 3
+
+CHUNK_STATUSES = ['pending', 'running', 'done', 'failed']
+
+# MongoDB connection setup
+def connect_mongo(mongo_uri, mongo_db_name):
+    from pymongo import MongoClient
+    client = MongoClient(mongo_uri)
+    db = client[mongo_db_name]
+    return db
+
+# Identify this worker in lease documents (unique per container, process and worker)
+def worker_identity():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def ensure_indexes(chunks):
+    chunks.create_index([('status', 1), ('run_id', 1), ('index', 1)])
+    chunks.create_index([('status', 1), ('lease_expires', 1)])
+
+# Split a run of total items into chunk documents; a run id can only be created once
+def create_run(chunks, run_id, command, context, total, chunk_size, params):
+    if chunks.count_documents({'run_id': run_id}, limit=1):
+        raise ValueError(f"Run {run_id} already exists.")
+    now = datetime.now(timezone.utc)
+    documents = [
+        {
+            '_id': f"{run_id}:{index:05d}",
+            'run_id': run_id,
+            'index': index,
+            'command': command,
+            'context': context,
+            'params': dict(params, count=min(chunk_size, total - start)),
+            'status': 'pending',
+            'attempts': 0,
+            'lease_owner': None,
+            'lease_expires': None,
+            'created_at': now,
+        }
+        for index, start in enumerate(range(0, total, chunk_size))
+    ]
+    if documents:
+        chunks.insert_many(documents)
+    return len(documents)
+
+def _run_filter(run_id):
+    return {'run_id': run_id} if run_id else {}
+
+# Atomically take the next pending chunk, or one whose lease expired, and lease it to worker_id
+def claim_chunk(chunks, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, run_id=None):
+    from pymongo import ReturnDocument
+    now = datetime.now(timezone.utc)
+    return chunks.find_one_and_update(
+        {**_run_filter(run_id),
+         '$or': [{'status': 'pending'}, {'status': 'running', 'lease_expires': {'$lt': now}}],
+         'attempts': {'$lt': MAX_ATTEMPTS}},
+        {'$set': {'status': 'running', 'lease_owner': worker_id, 'lease_expires': now + timedelta(seconds=lease_seconds),
+                  'started_at': now},
+         '$inc': {'attempts': 1}},
+        sort=[('index', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+# Extend a lease; returns False if the chunk was reclaimed by another worker
+def renew_lease(chunks, chunk, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    result = chunks.update_one(
+        {'_id': chunk['_id'], 'status': 'running', 'lease_owner': worker_id},
+        {'$set': {'lease_expires': datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)}}
+    )
+    return result.matched_count == 1
+
+# Record a chunk's result; returns False if the lease was lost (another worker may also have run it)
+def complete_chunk(chunks, chunk, worker_id, result):
+    update = chunks.update_one(
+        {'_id': chunk['_id'], 'status': 'running', 'lease_owner': worker_id},
+        {'$set': {'status': 'done', 'result': result, 'finished_at': datetime.now(timezone.utc), 'lease_expires': None}}
+    )
+    return update.matched_count == 1
+
+# Release a chunk after an error: back to pending for another attempt, or failed once attempts run out
+def fail_chunk(chunks, chunk, worker_id, error):
+    status = 'failed' if chunk['attempts'] >= MAX_ATTEMPTS else 'pending'
+    update = chunks.update_one(
+        {'_id': chunk['_id'], 'status': 'running', 'lease_owner': worker_id},
+        {'$set': {'status': status, 'error': error, 'lease_owner': None, 'lease_expires': None,
+                  'finished_at': datetime.now(timezone.utc)}}
+    )
+    return update.matched_count == 1
+
+# Mark chunks whose lease expired on their last attempt as failed, so they stop counting as running
+def expire_exhausted(chunks, run_id=None):
+    now = datetime.now(timezone.utc)
+    chunks.update_many(
+        {**_run_filter(run_id), 'status': 'running', 'lease_expires': {'$lt': now}, 'attempts': {'$gte': MAX_ATTEMPTS}},
+        {'$set': {'status': 'failed', 'error': 'lease expired', 'lease_owner': None, 'lease_expires': None}}
+    )
+
+# True while a run (or any run) still has chunks to claim or being worked on
+def has_open_chunks(chunks, run_id=None):
+    return chunks.count_documents({**_run_filter(run_id), 'status': {'$in': ['pending', 'running']}}, limit=1) > 0
+
+# Chunk counts per status and the summed results of finished chunks
+def run_status(chunks, run_id):
+    status = {'run_id': run_id, 'chunks': {name: 0 for name in CHUNK_STATUSES}, 'results': {}}
+    for row in chunks.aggregate([
+        {'$match': {'run_id': run_id}},
+        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+    ]):
+        status['chunks'][row['_id']] = row['count']
+    for chunk in chunks.find({'run_id': run_id, 'status': 'done'}, {'_id': 0, 'result': 1}):
+        for key, value in (chunk.get('result') or {}).items():
+            if isinstance(value, (int, float)):
+                status['results'][key] = round(status['results'].get(key, 0) + value, 3)
+    return status
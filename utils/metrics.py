@@ -0,0 +1,144 @@
+import time
+import math
+import contextvars
+from array import array
+
+# Latencies kept for percentiles (the most recent ones, in a ring)
+LATENCY_SAMPLES = 4096
+
+# Seconds of per-second completion counts kept for throughput
+RATE_WINDOW_SECONDS = 60
+
+# Cumulative latency histogram, for the percentiles of one run (see run_history.py): log-spaced buckets
+# from 0.1 ms to 100 s, each about 12% wide
+HISTOGRAM_MIN_SECONDS = 1e-4
+HISTOGRAM_BUCKETS_PER_DECADE = 20
+HISTOGRAM_BUCKETS = 6 * HISTOGRAM_BUCKETS_PER_DECADE
+
+# Context label attached to every request recorded in the current task (each script sets it from its --context)
+current_context = contextvars.ContextVar('metrics_context', default='-')
+
+def _new_counts():
+    return {'planned': 0, 'sent': 0, 'success': 0, 'failed': 0}
+
+# Latency in milliseconds at percentile p of a histogram from Metrics.totals() (the middle of the bucket it falls in)
+def histogram_percentile(histogram, p):
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = p / 100 * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= rank and count:
+            return round(HISTOGRAM_MIN_SECONDS * 10 ** ((bucket + 0.5) / HISTOGRAM_BUCKETS_PER_DECADE) * 1000, 1)
+    return None
+
+# In-memory metrics for the requests a process sends
+# The send loop is the only writer, and each update is a few integer and array stores with no lock.
+# Readers (the status server thread) copy what they need in snapshot(); a snapshot taken mid-update
+# can be off by the request being recorded, which is fine for a progress view.
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.progress = {}
+        self.errors = {}
+        self.in_flight = 0
+        self.latencies = array('d', bytes(8 * LATENCY_SAMPLES))
+        self.latency_count = 0
+        self.histogram = array('q', bytes(8 * HISTOGRAM_BUCKETS))
+        self.second_counts = array('q', bytes(8 * RATE_WINDOW_SECONDS))
+        self.second_stamps = array('q', bytes(8 * RATE_WINDOW_SECONDS))
+
+    def _counts(self, kind):
+        key = (current_context.get(), kind)
+        counts = self.progress.get(key)
+        if counts is None:
+            counts = self.progress[key] = _new_counts()
+        return counts
+
+    # Declare how many requests of a kind a run is about to send (drives the progress bars)
+    def plan(self, kind, count):
+        self._counts(kind)['planned'] += count
+
+    # A request was created; it counts toward the queue depth until it is recorded
+    def start(self):
+        self.in_flight += 1
+
+    # A created request was dropped before it was sent (e.g. cancelled while waiting for a concurrency slot)
+    def abandon(self):
+        self.in_flight -= 1
+
+    # A request finished with an HTTP status (or "error") after latency seconds
+    def record(self, kind, status, latency):
+        self.in_flight -= 1
+        counts = self._counts(kind)
+        counts['sent'] += 1
+        if status == 200:
+            counts['success'] += 1
+        else:
+            counts['failed'] += 1
+            key = str(status)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+        self.latencies[self.latency_count % LATENCY_SAMPLES] = latency
+        self.latency_count += 1
+        bucket = int(math.log10(max(latency, HISTOGRAM_MIN_SECONDS) / HISTOGRAM_MIN_SECONDS) * HISTOGRAM_BUCKETS_PER_DECADE)
+        self.histogram[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+        second = int(time.time())
+        slot = second % RATE_WINDOW_SECONDS
+        if self.second_stamps[slot] != second:
+            self.second_stamps[slot] = second
+            self.second_counts[slot] = 0
+        self.second_counts[slot] += 1
+
+    # Requests per second completed over the last `seconds` full seconds (or since start, if that is shorter)
+    def _rate(self, stamps, counts, now, seconds):
+        seconds = min(seconds, max(1, now - int(self.started_at)))
+        return sum(count for stamp, count in zip(stamps, counts) if now - seconds <= stamp < now) / seconds
+
+    # Cumulative counts per kind of request, errors by status and the latency histogram since the process started;
+    # the difference between two of these is what happened in between
+    def totals(self):
+        kinds = {}
+        for (_, kind), counts in list(self.progress.items()):
+            kind_totals = kinds.setdefault(kind, {'sent': 0, 'success': 0, 'failed': 0})
+            for key in kind_totals:
+                kind_totals[key] += counts[key]
+        return {'kinds': kinds, 'errors': dict(self.errors), 'histogram': self.histogram.tolist()}
+
+    def snapshot(self):
+        now = int(time.time())
+        stamps, counts = self.second_stamps.tolist(), self.second_counts.tolist()
+        latencies = sorted(self.latencies[:min(self.latency_count, LATENCY_SAMPLES)].tolist())
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1)
+
+        progress = []
+        for (context, kind), kind_counts in list(self.progress.items()):
+            kind_counts = dict(kind_counts)
+            kind_counts['context'], kind_counts['kind'] = context, kind
+            kind_counts['error_rate'] = round(kind_counts['failed'] / kind_counts['sent'], 4) if kind_counts['sent'] else 0.0
+            progress.append(kind_counts)
+
+        sent = sum(row['sent'] for row in progress)
+        failed = sum(row['failed'] for row in progress)
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'throughput': {'last_10s': round(self._rate(stamps, counts, now, 10), 1),
+                           'last_60s': round(self._rate(stamps, counts, now, 60), 1)},
+            'latency_ms': {'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99)},
+            'sent': sent,
+            'failed': failed,
+            'error_rate': round(failed / sent, 4) if sent else 0.0,
+            'errors': dict(self.errors),
+            'queue_depth': self.in_flight,
+            'progress': progress,
+        }
+
+# The process-wide metrics every sender records into
+metrics = Metrics()
@@ -0,0 +1,135 @@
+import numpy as np
+
+CHANNELS = ["IN-STORE", "MOBILE"]
+PAYMENT_TYPES = ["Credit", "Cash", "Gift Card"]
+
+# Behavioral archetypes per context. Each customer gets one, jittered, and stored on their Mongo document.
+# spend_median/spend_sigma: lognormal transaction amount, mobile_share: chance of a MOBILE order,
+# payment_mix: probabilities aligned with PAYMENT_TYPES, basket_mean: average items per basket,
+# weekly_frequency: average transactions per week, weight: share of customers with this archetype
+ARCHETYPES = {
+    'retail': {
+        'bargain_hunter': {'spend_median': 28.0, 'spend_sigma': 0.45, 'mobile_share': 0.35, 'payment_mix': [0.55, 0.35, 0.10], 'basket_mean': 2.5, 'weekly_frequency': 0.6, 'weight': 0.35},
+        'regular':        {'spend_median': 55.0, 'spend_sigma': 0.40, 'mobile_share': 0.45, 'payment_mix': [0.70, 0.20, 0.10], 'basket_mean': 2.0, 'weekly_frequency': 0.4, 'weight': 0.45},
+        'premium':        {'spend_median': 140.0, 'spend_sigma': 0.50, 'mobile_share': 0.55, 'payment_mix': [0.85, 0.05, 0.10], 'basket_mean': 3.0, 'weekly_frequency': 0.3, 'weight': 0.20},
+    },
+    'qsr': {
+        'commuter':       {'spend_median': 9.0, 'spend_sigma': 0.30, 'mobile_share': 0.70, 'payment_mix': [0.75, 0.15, 0.10], 'basket_mean': 1.5, 'weekly_frequency': 4.0, 'weight': 0.35},
+        'lunch_regular':  {'spend_median': 14.0, 'spend_sigma': 0.30, 'mobile_share': 0.50, 'payment_mix': [0.70, 0.25, 0.05], 'basket_mean': 1.8, 'weekly_frequency': 3.0, 'weight': 0.35},
+        'family':         {'spend_median': 32.0, 'spend_sigma': 0.35, 'mobile_share': 0.40, 'payment_mix': [0.70, 0.20, 0.10], 'basket_mean': 4.0, 'weekly_frequency': 1.2, 'weight': 0.30},
+    },
+    'fuel': {
+        'commuter':       {'spend_median': 45.0, 'spend_sigma': 0.25, 'mobile_share': 0.20, 'payment_mix': [0.80, 0.15, 0.05], 'basket_mean': 1.2, 'weekly_frequency': 2.0, 'weight': 0.50},
+        'occasional':     {'spend_median': 35.0, 'spend_sigma': 0.35, 'mobile_share': 0.10, 'payment_mix': [0.60, 0.35, 0.05], 'basket_mean': 1.3, 'weekly_frequency': 0.7, 'weight': 0.30},
+        'road_tripper':   {'spend_median': 70.0, 'spend_sigma': 0.30, 'mobile_share': 0.15, 'payment_mix': [0.85, 0.10, 0.05], 'basket_mean': 2.0, 'weekly_frequency': 0.5, 'weight': 0.20},
+    },
+}
+
+# Size of the simulated store staff each transaction's pos_employee_id is drawn from
+EMPLOYEE_POOL_SIZE = 40
+
+# Archetype names across every context; persona columns store an archetype as its index here
+ARCHETYPE_NAMES = sorted({name for archetypes in ARCHETYPES.values() for name in archetypes})
+
+# Numeric persona fields stored as one column each (payment_mix is an (n, len(PAYMENT_TYPES)) column)
+PERSONA_FIELDS = ('spend_median', 'spend_sigma', 'mobile_share', 'basket_mean', 'weekly_frequency')
+
+# Rounding applied when a persona is turned back into a document, matching generate_personas
+PERSONA_ROUNDING = {'spend_median': 2, 'spend_sigma': 3, 'mobile_share': 3, 'basket_mean': 2, 'weekly_frequency': 3}
+
+# Persona used for customers created before personas existed
+def default_persona(context):
+    archetypes = ARCHETYPES[context]
+    name = max(archetypes, key=lambda archetype: archetypes[archetype]['weight'])
+    persona = {key: value for key, value in archetypes[name].items() if key != 'weight'}
+    persona['archetype'] = name
+    return persona
+
+# Generate n personas for a context: pick archetypes by weight, then jitter each parameter
+def generate_personas(n, context, rng=None):
+    rng = rng or np.random.default_rng()
+    if n <= 0:
+        return []
+    archetypes = ARCHETYPES[context]
+    names = list(archetypes)
+    weights = np.array([archetypes[name]['weight'] for name in names])
+    picks = rng.choice(len(names), size=n, p=weights / weights.sum())
+
+    base = {key: np.array([archetypes[names[pick]][key] for pick in picks], dtype=np.float64)
+            for key in ('spend_median', 'spend_sigma', 'mobile_share', 'basket_mean', 'weekly_frequency')}
+    spend_median = base['spend_median'] * rng.lognormal(0.0, 0.2, n)
+    mobile_share = np.clip(base['mobile_share'] + rng.normal(0.0, 0.1, n), 0.0, 1.0)
+    basket_mean = np.maximum(1.0, base['basket_mean'] * rng.lognormal(0.0, 0.15, n))
+    weekly_frequency = base['weekly_frequency'] * rng.lognormal(0.0, 0.3, n)
+    mixes = np.array([archetypes[names[pick]]['payment_mix'] for pick in picks])
+    # Dirichlet draw around each archetype's mix, vectorized as row-normalized gamma draws
+    gammas = rng.gamma(mixes * 50.0)
+    payment_mix = gammas / gammas.sum(axis=1, keepdims=True)
+
+    return [
+        {
+            'archetype': names[picks[i]],
+            'spend_median': round(float(spend_median[i]), 2),
+            'spend_sigma': float(base['spend_sigma'][i]),
+            'mobile_share': round(float(mobile_share[i]), 3),
+            'payment_mix': [round(float(p), 3) for p in payment_mix[i]],
+            'basket_mean': round(float(basket_mean[i]), 2),
+            'weekly_frequency': round(float(weekly_frequency[i]), 3),
+        }
+        for i in range(n)
+    ]
+
+# Personas as columns: a float32 (or dtype) array per numeric field, payment_mix as an (n, 3) array and archetype codes
+# Missing personas (and fields missing from older ones) take the context's default persona
+def persona_columns(personas, context, dtype=np.float32):
+    fallback = default_persona(context)
+    personas = [persona or fallback for persona in personas]
+    columns = {key: np.array([persona.get(key, fallback[key]) for persona in personas], dtype=dtype)
+               for key in PERSONA_FIELDS}
+    columns['payment_mix'] = np.array([persona.get('payment_mix', fallback['payment_mix']) for persona in personas],
+                                      dtype=dtype).reshape(len(personas), len(PAYMENT_TYPES))
+    columns['archetype'] = np.array([ARCHETYPE_NAMES.index(persona.get('archetype', fallback['archetype']))
+                                     for persona in personas], dtype=np.uint8)
+    return columns
+
+# The persona document for row i of persona columns
+def persona_from_columns(columns, i):
+    persona = {'archetype': ARCHETYPE_NAMES[columns['archetype'][i]]}
+    for key in PERSONA_FIELDS:
+        persona[key] = round(float(columns[key][i]), PERSONA_ROUNDING[key])
+    persona['payment_mix'] = [round(float(p), 3) for p in columns['payment_mix'][i]]
+    return persona
+
+# Draw the per-transaction fields for a batch of personas in one vectorized pass
+# personas is a list of persona documents (None for the default) or persona columns (see persona_columns)
+# Returns lists aligned with personas: amount, channel, payment_type, basket_size, pos_employee_id
+def draw_transaction_fields(personas, context, rng=None):
+    rng = rng or np.random.default_rng()
+    columns = personas if isinstance(personas, dict) else persona_columns(personas, context, np.float64)
+    n = len(columns['spend_median'])
+    if n == 0:
+        return {'amount': [], 'channel': [], 'payment_type': [], 'basket_size': [], 'pos_employee_id': []}
+
+    spend_median = columns['spend_median'].astype(np.float64)
+    spend_sigma = columns['spend_sigma'].astype(np.float64)
+    mobile_share = columns['mobile_share'].astype(np.float64)
+    basket_mean = columns['basket_mean'].astype(np.float64)
+    payment_mix = columns['payment_mix'].astype(np.float64)
+
+    amounts = np.round(np.maximum(1.0, rng.lognormal(np.log(spend_median), spend_sigma)), 2)
+    channels = np.where(rng.random(n) < mobile_share, 1, 0)
+
+    # Inverse-CDF draw of each row's payment mix
+    cumulative = np.cumsum(payment_mix / payment_mix.sum(axis=1, keepdims=True), axis=1)
+    payments = np.minimum((rng.random((n, 1)) > cumulative).sum(axis=1), len(PAYMENT_TYPES) - 1)
+
+    basket_sizes = 1 + rng.poisson(basket_mean - 1.0)
+    employees = 100000 + rng.integers(EMPLOYEE_POOL_SIZE, size=n)
+
+    return {
+        'amount': amounts.tolist(),
+        'channel': [CHANNELS[i] for i in channels.tolist()],
+        'payment_type': [PAYMENT_TYPES[i] for i in payments.tolist()],
+        'basket_size': basket_sizes.tolist(),
+        'pos_employee_id': [str(e) for e in employees.tolist()],
+    }
@@ -0,0 +1,190 @@
+import numpy as np
+from datetime import datetime, timezone
+from personas import persona_columns, persona_from_columns, generate_personas
+
+# Fields holding UUID strings, packed as 16-byte values
+ID_FIELDS = ('user_id', 'external_id')
+
+# Fields holding timestamps (datetimes or ISO strings in Mongo), stored as int64 epoch milliseconds
+TIMESTAMP_FIELDS = ('timestamp', 'lasttxn_timestamp')
+
+# Stored for a missing timestamp
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+# Documents read from a cursor before they are packed into arrays
+CHUNK_SIZE = 50000
+
+# Hex digit -> value (255 for anything else), value -> lowercase hex digit, and where the hex digits of a UUID string sit
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b'0123456789abcdef', dtype=np.uint8)] = np.arange(16, dtype=np.uint8)
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_DASHES = [8, 13, 18, 23]
+_HEX_POSITIONS = [i for i in range(36) if i not in _DASHES]
+
+def _ids_as_bytes(values):
+    return np.array([(value or '').encode() for value in values], dtype=bytes)
+
+# Pack id strings into an array of 16-byte values; ids that are not all lowercase canonical UUIDs are kept as bytes
+def pack_ids(values):
+    if not values:
+        return np.empty(0, dtype='V16')
+    text = np.array(values)
+    if text.dtype != np.dtype('U36') or (np.char.str_len(text) != 36).any():
+        return _ids_as_bytes(values)
+    try:
+        chars = text.astype('S36').view(np.uint8).reshape(len(values), 36)
+    except UnicodeEncodeError:
+        return _ids_as_bytes(values)
+    digits = _HEX_VALUES[chars[:, _HEX_POSITIONS]]
+    if (chars[:, _DASHES] != ord('-')).any() or (digits == 255).any():
+        return _ids_as_bytes(values)
+    packed = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    return np.ascontiguousarray(packed).view('V16').ravel()
+
+# Id strings back from pack_ids
+def unpack_ids(column):
+    if column.dtype != np.dtype('V16'):
+        return np.char.decode(column, 'utf-8').tolist()
+    raw = np.ascontiguousarray(column).view(np.uint8).reshape(len(column), 16)
+    chars = np.full((len(column), 36), ord('-'), dtype=np.uint8)
+    chars[:, _HEX_POSITIONS[0::2]] = _HEX_DIGITS[raw >> 4]
+    chars[:, _HEX_POSITIONS[1::2]] = _HEX_DIGITS[raw & 15]
+    return chars.view('S36').ravel().astype('U36').tolist()
+
+def _concat_ids(columns):
+    if len({column.dtype == np.dtype('V16') for column in columns}) > 1:
+        columns = [column if column.dtype != np.dtype('V16') else _ids_as_bytes(unpack_ids(column)) for column in columns]
+    return np.concatenate(columns)
+
+# Epoch milliseconds of a Mongo timestamp (naive UTC datetime or ISO string)
+def _epoch_ms(value):
+    if value is None:
+        return MISSING_TIMESTAMP
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+# Users selected from Mongo, held as columns instead of a dict per user
+# user_id and external_id are 16-byte packed UUIDs, timestamps int64 epoch milliseconds, personas numeric columns
+# (see personas.persona_columns) and any other field (e.g. a sampling segment) small integer codes.
+# About 70 bytes per user, so a million users take tens of megabytes. Rows are read by index in O(1),
+# and take, slicing, sample and shuffle index every column at once without creating an object per user.
+class Population:
+    def __init__(self, columns, personas=None, has_persona=None, labels=None):
+        self.columns = columns
+        self.personas = personas
+        self.has_persona = has_persona
+        self.labels = labels or {}
+
+    # Pack documents (e.g. a projected Mongo cursor) in chunks; context gives missing personas their default
+    @classmethod
+    def from_documents(cls, documents, fields, context=None):
+        fields = list(fields)
+        codes = {field: {} for field in fields if field not in ID_FIELDS + TIMESTAMP_FIELDS + ('persona',)}
+        parts = []
+        chunk = []
+        for document in documents:
+            chunk.append(document)
+            if len(chunk) == CHUNK_SIZE:
+                parts.append(cls._pack(chunk, fields, codes, context))
+                chunk = []
+        if chunk or not parts:
+            parts.append(cls._pack(chunk, fields, codes, context))
+        labels = {field: list(field_codes) for field, field_codes in codes.items()}
+        return cls.concat(parts, labels)
+
+    @classmethod
+    def _pack(cls, documents, fields, codes, context):
+        columns = {}
+        personas = has_persona = None
+        for field in fields:
+            values = [document.get(field) for document in documents]
+            if field in ID_FIELDS:
+                columns[field] = pack_ids(values)
+            elif field in TIMESTAMP_FIELDS:
+                columns[field] = np.array([_epoch_ms(value) for value in values], dtype=np.int64)
+            elif field == 'persona':
+                personas = persona_columns(values, context)
+                has_persona = np.array([bool(value) for value in values], dtype=bool)
+            else:
+                field_codes = codes[field]
+                columns[field] = np.array([field_codes.setdefault(value, len(field_codes)) for value in values], dtype=np.int32)
+        return cls(columns, personas, has_persona)
+
+    # One population from several with the same fields, in order
+    @classmethod
+    def concat(cls, parts, labels=None):
+        first = parts[0]
+        columns = {field: _concat_ids([part.columns[field] for part in parts]) if field in ID_FIELDS
+                   else np.concatenate([part.columns[field] for part in parts]) for field in first.columns}
+        personas = has_persona = None
+        if first.personas is not None:
+            personas = {key: np.concatenate([part.personas[key] for part in parts]) for key in first.personas}
+            has_persona = np.concatenate([part.has_persona for part in parts])
+        return cls(columns, personas, has_persona, labels if labels is not None else first.labels)
+
+    def __len__(self):
+        if self.has_persona is not None:
+            return len(self.has_persona)
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    # Rows at indices (an index array, mask or slice); slices are views rather than copies
+    def take(self, indices):
+        return Population({field: column[indices] for field, column in self.columns.items()},
+                          None if self.personas is None else {key: column[indices] for key, column in self.personas.items()},
+                          None if self.has_persona is None else self.has_persona[indices],
+                          self.labels)
+
+    def __getitem__(self, indices):
+        return self.take(indices)
+
+    @property
+    def nbytes(self):
+        arrays = list(self.columns.values()) + list((self.personas or {}).values())
+        return sum(array.nbytes for array in arrays) + (self.has_persona.nbytes if self.has_persona is not None else 0)
+
+    # Uniform sample of k rows without replacement
+    def sample(self, k, rng=None):
+        rng = rng or np.random.default_rng()
+        k = max(0, min(k, len(self)))
+        return self.take(np.sort(rng.choice(len(self), size=k, replace=False)))
+
+    def shuffle(self, rng=None):
+        rng = rng or np.random.default_rng()
+        return self.take(rng.permutation(len(self)))
+
+    # Id strings of a field, for building request payloads
+    def ids(self, field):
+        return unpack_ids(self.columns[field])
+
+    def user_ids(self):
+        return self.ids('user_id')
+
+    def external_ids(self):
+        return self.ids('external_id')
+
+    # The id of one row
+    def id(self, field, i):
+        return unpack_ids(self.columns[field][i:i + 1])[0]
+
+    # Original values of a coded field (e.g. the sampling segment)
+    def values(self, field):
+        labels = self.labels[field]
+        return [labels[code] for code in self.columns[field].tolist()]
+
+    # The persona document of one row
+    def persona(self, i):
+        return persona_from_columns(self.personas, i)
+
+    # Give a persona to every user that predates personas; returns a mask of the rows that were filled in
+    def fill_missing_personas(self, context, rng=None):
+        missing = ~self.has_persona
+        count = int(missing.sum())
+        if count:
+            generated = persona_columns(generate_personas(count, context, rng), context)
+            for key, column in self.personas.items():
+                column[missing] = generated[key]
+            self.has_persona[missing] = True
+        return missing
@@ -0,0 +1,81 @@
+import os
+import json
+import asyncio
+from datetime import datetime, timezone
+from metrics import metrics
+from concurrency import TrackedRequest, limiter_for
+from profiling import profiler
+from http_policy import encode_body, read_response
+
+# Path of the user_profile model, relative to the core host
+PROFILE_PATH = '/priv/v1/apps/{username}/users/{user_id}/models/user_profile'
+
+# Results are appended here, one JSON object per line, so runs add to the log instead of overwriting it
+LOG_DIR = 'logs'
+LOG_FILE = 'user_profile_updates.ndjson'
+
+# Queue of user_profile updates sent concurrently over one session
+# Fields queued for a user whose update has not gone out yet are merged into that update, so several field
+# changes for the same user cost one PUT. The API has no bulk user_profile endpoint, so each user is one request;
+# concurrency is set by the profile_updates limiter (see concurrency.py).
+class ProfileUpdateQueue:
+    def __init__(self, session, host, username, auth, logger):
+        self.session = session
+        self.url = host + PROFILE_PATH.format(username=username, user_id='{user_id}')
+        self.headers = {'Content-Type': 'application/json', 'Authorization': auth.encode()}
+        self.logger = logger
+        self.pending = {}
+        self.queue = asyncio.Queue()
+        self.counts = {"sent": 0, "success": 0, "failed": 0, "coalesced": 0}
+        os.makedirs(LOG_DIR, exist_ok=True)
+        self.log_file = open(os.path.join(LOG_DIR, LOG_FILE), 'a')
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(limiter_for('profile_updates').ceiling)]
+
+    # Queue fields to set on a user's profile
+    def update(self, user_id, fields):
+        if user_id in self.pending:
+            self.pending[user_id].update(fields)
+            self.counts["coalesced"] += 1
+            return
+        self.pending[user_id] = dict(fields)
+        metrics.plan("profile_updates", 1)
+        self.queue.put_nowait(user_id)
+
+    async def _worker(self):
+        while True:
+            user_id = await self.queue.get()
+            try:
+                await self._send(user_id, self.pending.pop(user_id))
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, user_id, fields):
+        import aiohttp
+        with profiler.stage("encode"):
+            body, encoding_headers = encode_body("profile_updates", {"user_profile": fields})
+        async with TrackedRequest("profile_updates") as request:
+            try:
+                async with self.session.put(self.url.format(user_id=user_id), headers={**self.headers, **encoding_headers},
+                                            data=body) as response:
+                    request.status = response.status
+                    response_text = await read_response("profile_updates", response)
+            except aiohttp.ClientError as e:
+                self.logger.error(f"Client error: {e}")
+                response_text = str(e)
+            except Exception as e:
+                self.logger.error(f"Unexpected error: {e}")
+                response_text = str(e)
+        self.logger.info(f"User profile update Response Status: {request.status}, Response Text: {response_text}")
+        self.counts["sent"] += 1
+        self.counts["success" if request.status == 200 else "failed"] += 1
+        self.log_file.write(json.dumps({"time": datetime.now(timezone.utc).isoformat(), "user_id": user_id, "fields": fields,
+                                        "status": request.status, "response": response_text}) + '\n')
+
+    # Wait for every queued update to be sent, then stop the workers and close the log
+    async def close(self):
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.log_file.close()
+        return self.counts
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from datetime import datetime, timezone
+
+# Values of --profile: stage timers and stack samples only, or also a cProfile and/or tracemalloc capture
+PROFILE_MODES = ('stages', 'cprofile', 'tracemalloc', 'all')
+
+# Reports are written next to the other logs
+LOG_DIR = 'logs'
+
+# How often the stack sampler records where each profiled thread is (the folded stack dump)
+SAMPLE_INTERVAL_SECONDS = 0.01
+
+# Functions and allocation sites listed in the JSON report
+TOP_ENTRIES = 25
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+# One pass through a named stage on the current thread; stages opened inside it are reported as parent/child
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.thread = threading.get_ident()
+        self.parent = profiler._active.get(self.thread)
+        self.path = f"{self.parent}/{self.name}" if self.parent else self.name
+        profiler._active[self.thread] = self.path
+        self.memory = profiler._traced_memory()
+        self.cpu = time.thread_time()
+        self.started = time.perf_counter()
+        profiler.begin(self.path, self.started)
+        return self
+
+    def __exit__(self, *exc_info):
+        ended = time.perf_counter()
+        profiler = self.profiler
+        cpu = time.thread_time() - self.cpu
+        allocated = profiler._traced_memory() - self.memory if self.memory is not None else None
+        if self.parent is None:
+            profiler._active.pop(self.thread, None)
+        else:
+            profiler._active[self.thread] = self.parent
+        profiler.end(self.path, ended, ended - self.started, cpu, allocated)
+        return False
+
+# Per-stage timings for one run, with optional cProfile and tracemalloc capture
+# Code marks its stages with `with profiler.stage(name)` (or the staged decorator); while profiling is off that is a
+# shared no-op. Each stage reports its calls, total time (summed over concurrent calls), active time (wall time with
+# at least one call open, comparable to the run's wall time), CPU time of the thread it ran on and, with tracemalloc,
+# the net memory it allocated. Concurrent operations timed elsewhere (HTTP requests, see concurrency.TrackedRequest)
+# report through begin/end without CPU time. A sampler thread records the stack of the event loop thread and of
+# threads inside a stage, rooted at the stage, as folded stacks for flamegraph.pl or speedscope.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.mode = None
+        self.stages = {}
+        self.stacks = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._tracing = False
+        self._cprofile = None
+
+    def stage(self, name):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    # Decorator running a function as a stage
+    def staged(self, name):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def begin(self, name, now=None):
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = {"calls": 0, "total": 0.0, "active": 0.0, "cpu": None, "allocated": None,
+                                             "open": 0, "opened_at": 0.0}
+            if stats["open"] == 0:
+                stats["opened_at"] = now
+            stats["open"] += 1
+
+    def end(self, name, now, seconds, cpu=None, allocated=None):
+        with self._lock:
+            stats = self.stages[name]
+            stats["calls"] += 1
+            stats["total"] += seconds
+            stats["open"] -= 1
+            if stats["open"] == 0:
+                stats["active"] += now - stats["opened_at"]
+            if cpu is not None:
+                stats["cpu"] = (stats["cpu"] or 0.0) + cpu
+            if allocated is not None:
+                stats["allocated"] = (stats["allocated"] or 0) + allocated
+
+    def _traced_memory(self):
+        if not self._tracing:
+            return None
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[0]
+
+    def start(self, mode):
+        self.mode = mode
+        self.stages = {}
+        self.stacks = {}
+        self._main_thread = threading.get_ident()
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        if mode in ('tracemalloc', 'all'):
+            import tracemalloc
+            tracemalloc.start()
+            self._tracing = True
+        if mode in ('cprofile', 'all'):
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._stop_sampling = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+        self._sampler.start()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        self.wall = time.perf_counter() - self.started
+        self.cpu = time.process_time() - self.cpu_started
+        self._stop_sampling.set()
+        self._sampler.join()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def _sample(self):
+        while not self._stop_sampling.wait(SAMPLE_INTERVAL_SECONDS):
+            for thread, frame in sys._current_frames().items():
+                stage = self._active.get(thread)
+                if stage is None:
+                    if thread != self._main_thread:
+                        continue
+                    stage = 'unstaged'
+                labels = []
+                while frame is not None:
+                    code = frame.f_code
+                    labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(stage.split('/') + labels[::-1])
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def _cprofile_top(self):
+        import pstats
+        stats = pstats.Stats(self._cprofile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_ENTRIES]
+        return [{"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                 "own_s": round(own, 4), "cumulative_s": round(cumulative, 4)}
+                for (filename, line, name), (_, calls, own, cumulative, _) in rows]
+
+    def _tracemalloc_top(self):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                               tracemalloc.Filter(False, __file__)])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self._tracing = False
+        return {"peak_mb": round(peak / 1e6, 2),
+                "top": [{"line": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                         "size_mb": round(stat.size / 1e6, 3), "blocks": stat.count}
+                        for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]]}
+
+    def report(self, label):
+        stages = {}
+        for name, stats in sorted(self.stages.items(), key=lambda item: item[1]["active"], reverse=True):
+            stages[name] = {"calls": stats["calls"], "total_s": round(stats["total"], 4), "active_s": round(stats["active"], 4),
+                            "share": round(stats["active"] / max(self.wall, 1e-9), 4),
+                            "cpu_s": round(stats["cpu"], 4) if stats["cpu"] is not None else None,
+                            "allocated_mb": round(stats["allocated"] / 1e6, 3) if stats["allocated"] is not None else None}
+        report = {"command": label, "mode": self.mode, "started_at": self.started_at.isoformat(),
+                  "wall_s": round(self.wall, 4), "cpu_s": round(self.cpu, 4), "stages": stages,
+                  "stack_samples": sum(self.stacks.values())}
+        if self._cprofile is not None:
+            report["cprofile"] = self._cprofile_top()
+        if self._tracing:
+            report["tracemalloc"] = self._tracemalloc_top()
+        return report
+
+    # Write the JSON breakdown, the folded stacks and (with cProfile) a pstats file to logs/, and print the breakdown
+    def write_report(self, label):
+        report = self.report(label)
+        os.makedirs(LOG_DIR, exist_ok=True)
+        base = os.path.join(LOG_DIR, f"profile_{label}_{self.started_at.strftime('%Y%m%d%H%M%S')}")
+        report["files"] = {"stacks": base + '.folded'}
+        if self._cprofile is not None:
+            report["files"]["cprofile"] = base + '.prof'
+            self._cprofile.dump_stats(base + '.prof')
+            self._cprofile = None
+        with open(base + '.folded', 'w') as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+        with open(base + '.json', 'w') as file:
+            json.dump(report, file, indent=4)
+
+        print(f"Profile of {label}: wall {report['wall_s']:.2f}s, cpu {report['cpu_s']:.2f}s")
+        print(f"  {'stage':<28}{'calls':>9}{'active s':>11}{'share':>8}{'cpu s':>9}{'total s':>10}")
+        for name, stats in report["stages"].items():
+            cpu = f"{stats['cpu_s']:.3f}" if stats['cpu_s'] is not None else '-'
+            print(f"  {name:<28}{stats['calls']:>9}{stats['active_s']:>11.3f}{stats['share']:>8.1%}{cpu:>9}{stats['total_s']:>10.3f}")
+        print(f"Profile written to {base}.json")
+        return report
+
+profiler = Profiler()
+
+# Await a script's coroutine, profiling it when --profile was given
+# A script run inside an already profiled one (a worker's chunk, a scheduled job) is included in the outer profile
+async def profiled(mode, label, coro):
+    if not mode or profiler.enabled:
+        return await coro
+    profiler.start(mode)
+    try:
+        return await coro
+    finally:
+        profiler.stop()
+        profiler.write_report(label)
@@ -0,0 +1,446 @@
+import sys
+import os
+import json
+import argparse
+import logging
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from export import read_dataset, read_manifest
+from send_transactions import send_transaction, send_transaction_batch, format_transaction_time, random_uuids
+from async_mongo import connect_async
+from targets import new_run_id
+from idempotency import membership_cache
+from metrics import metrics, current_context
+from concurrency import TrackedRequest, set_ceiling
+from status_server import start_status_server
+from profiling import profiler, profiled
+from run_options import add_run_options
+from run_history import recorded
+from http_policy import encode_body, read_response, set_gzip, set_response_mode
+
+# Characters of a recorded JSON log read at a time when streaming it
+LOG_CHUNK_SIZE = 1 << 20
+
+# Collection in the context's database recording the transaction_id of every exported transaction a dataset replay
+# has sent, so replaying the same export again does not post its transactions twice
+REPLAYED_TRANSACTIONS = 'replayed_transactions'
+
+# Fields generate_customer_data sends; anything else on a logged user was added by the server
+CUSTOMER_FIELDS = ('external_id', 'email', 'first_name', 'last_name', 'opted_in', 'dob', 'address', 'city', 'zip', 'state',
+                   'country', 'user_profile')
+
+# Load and define environment variables based on argument
+def load_environment_variables(context):
+    from dotenv import load_dotenv
+    # Specify the path to the .env file in the root directory
+    env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+    load_dotenv(dotenv_path=env_path)
+    env_vars = {
+        'CLOUDPOS_ENDPOINT': os.getenv(f'{context.upper()}_CLOUDPOS_ENDPOINT'),
+        'AUTH_TOKEN': os.getenv(f'{context.upper()}_CLOUDPOS_AUTH_TOKEN'),
+        'STORE_ID': os.getenv(f'{context.upper()}_STORE_ID'),
+        'CLIENT_ID': os.getenv(f'{context.upper()}_CLIENT_ID'),
+        'MONGO_URI': os.getenv(f'{context.upper()}_MONGO_URI'),
+        'MONGO_DB_NAME': os.getenv(f'{context.upper()}_MONGO_DB_NAME'),
+        'MONGO_COLLECTION_NAME': os.getenv(f'{context.upper()}_MONGO_COLLECTION_NAME'),
+        'HOST': os.getenv(f'{context.upper()}_CORE_HOST'),
+        'USERNAME': os.getenv(f'{context.upper()}_CORE_USERNAME'),
+        'PASSWORD': os.getenv(f'{context.upper()}_CORE_PASSWORD')
+    }
+
+    for key, value in env_vars.items():
+        if value is None:
+            raise ValueError(f"Essential environment variable {key} is not set for context {context}.")
+
+    return env_vars
+
+# Configure logging
+def setup_logging():
+    LOG_DIR = 'logs'
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(LOG_DIR, 'replay.log'),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    return logger
+
+# Function to send one customer to the users API
+async def send_customer(session, payload, auth, api_url, logger):
+    import aiohttp
+    with profiler.stage("encode"):
+        body, encoding_headers = encode_body("customers", payload)
+    headers = {'Content-Type': 'application/json', **encoding_headers}
+    async with TrackedRequest("customers") as request:
+        try:
+            async with session.post(api_url, headers=headers, data=body, auth=auth) as response:
+                status = request.status = response.status
+                response_text = await read_response("customers", response)
+                logger.info(f"Customer Response Status: {status}, Response Text: {response_text}")
+                return {"status": status, "response": response_text}
+        except aiohttp.ClientError as e:
+            logger.error(f"Client error: {e}")
+            return {"status": "error", "response": str(e)}
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return {"status": "error", "response": str(e)}
+
+# Replay exported customers and store the created users in MongoDB, as generate_customers does
+# Customers whose external_id or email already exists (e.g. from an earlier, interrupted replay) are skipped
+async def replay_customers(session, input_dir, env_vars, logger, max_in_flight, run_id):
+    from aiohttp import BasicAuth
+
+    auth = BasicAuth(login=env_vars['USERNAME'], password=env_vars['PASSWORD'])
+    api_url = env_vars['HOST'] + f'/priv/v1/apps/{env_vars["USERNAME"]}/users'
+    collection = connect_async(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])[env_vars['MONGO_COLLECTION_NAME']]
+    cache = await collection.run(membership_cache)
+    pending_insert = None
+    semaphore = asyncio.Semaphore(max_in_flight)
+    counts = {"sent": 0, "success": 0, "failed": 0, "skipped": 0}
+
+    async def bounded_send(record):
+        async with semaphore:
+            return await send_customer(session, record['payload'], auth, api_url, logger)
+
+    for records in read_dataset(input_dir, 'customers'):
+        new_records = [record for record in records if not cache.seen(record.get('external_id'), record.get('email'))]
+        counts["skipped"] += len(records) - len(new_records)
+        records = new_records
+        metrics.plan("customers", len(records))
+        results = await asyncio.gather(*(bounded_send(record) for record in records))
+        user_records = []
+        for record, result in zip(records, results):
+            counts["sent"] += 1
+            if result["status"] != 200:
+                counts["failed"] += 1
+                continue
+            counts["success"] += 1
+            try:
+                user = json.loads(result["response"])["user"]
+                user_records.append({"user_id": user["id"], "external_id": user["external_id"], "email": user["email"],
+                                     "timestamp": datetime.now(timezone.utc), "persona": record.get("persona"), "run_id": run_id})
+                cache.add(user["external_id"], user["email"])
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                logger.error(f"Error parsing response: {e}")
+        # Store this part's users while the next part is being sent
+        if user_records:
+            if pending_insert:
+                await pending_insert
+            pending_insert = asyncio.create_task(collection.insert_many(user_records))
+
+    if pending_insert:
+        await pending_insert
+    return counts
+
+# Replay exported transactions with their exported ids, stamped with this environment's store and client ids
+# Transactions an earlier replay of the export already sent are skipped, as customers are; failed ones are retried
+async def replay_transactions(session, input_dir, env_vars, logger, max_in_flight):
+    from pymongo import UpdateOne
+
+    replayed = connect_async(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])[REPLAYED_TRANSACTIONS]
+    counts = {"sent": 0, "success": 0, "failed": 0, "skipped": 0}
+    for records in read_dataset(input_dir, 'transactions'):
+        transaction_ids = [record['payload']['request_payload']['transaction_id'] for record in records]
+        done = {doc['_id'] for doc in await replayed.find({'_id': {'$in': transaction_ids}}, {'_id': 1})}
+        transactions = []
+        for record, transaction_id in zip(records, transaction_ids):
+            if transaction_id in done:
+                counts["skipped"] += 1
+                continue
+            transaction_data = record['payload']
+            transaction_data['store_id'] = env_vars['STORE_ID']
+            transaction_data['client_id'] = env_vars['CLIENT_ID']
+            transactions.append(transaction_data)
+        results = await send_transaction_batch(session, transactions, env_vars['AUTH_TOKEN'], env_vars['CLOUDPOS_ENDPOINT'],
+                                               logger, max_in_flight)
+        sent_at = datetime.now(timezone.utc)
+        writes = []
+        for transaction_data, result in zip(transactions, results):
+            counts["sent"] += 1
+            if result["status"] != 200:
+                counts["failed"] += 1
+                continue
+            counts["success"] += 1
+            transaction_id = transaction_data['request_payload']['transaction_id']
+            writes.append(UpdateOne({'_id': transaction_id}, {'$setOnInsert': {'replayed_at': sent_at}}, upsert=True))
+        if writes:
+            await replayed.bulk_write(writes, ordered=False)
+    return counts
+
+# Parse a replay speed: a multiplier of the recorded timing ("1x", "10x", "0.5") or "max" for no waits (None)
+def parse_speed(value):
+    if value.lower() == 'max':
+        return None
+    try:
+        speed = float(value.lower().rstrip('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid speed: {value} (use e.g. 1x, 10x or max)")
+    if speed <= 0:
+        raise argparse.ArgumentTypeError(f"speed must be positive: {value}")
+    return speed
+
+# Stream the elements of a JSON array file (the logs are written with json.dump) without loading the whole file
+def iter_json_array(path, chunk_size=LOG_CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    with open(path) as file:
+        buffer = file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path} is not a JSON array.")
+        position = 1
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Need more data", buffer, position)
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"{path} ends before its JSON array is closed.")
+                more = file.read(chunk_size)
+                eof = not more
+                buffer, position = buffer[position:] + more, 0
+                continue
+            yield value
+
+# Stream the records of a recorded request log: a JSON array (.json) or one JSON document per line (.ndjson/.jsonl)
+def iter_log_records(path):
+    if path.endswith(('.ndjson', '.jsonl')):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(path)
+
+# Work out what a log record holds: ('customer', user), ('transaction', payload) or (None, None)
+# Accepts send_transactions log entries, generate_customers responses, export records and bare request bodies
+def classify_record(record):
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError:
+            return None, None
+    if not isinstance(record, dict):
+        return None, None
+    body = record.get('request_body') or record.get('payload') or record
+    if isinstance(body, dict) and isinstance(body.get('user'), dict):
+        return 'customer', body['user']
+    if isinstance(body, dict) and 'request_payload' in body:
+        return 'transaction', body
+    return None, None
+
+# Recorded send time of a customer or transaction as epoch seconds, or None when the log has none
+def record_time(kind, body):
+    value = body.get('created_at') if kind == 'customer' else body['request_payload'].get('open_time')
+    if not isinstance(value, str):
+        return None
+    # fromisoformat only accepts a trailing "Z" from Python 3.11 (the image runs 3.9)
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        recorded = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if recorded.tzinfo is None:
+        recorded = recorded.replace(tzinfo=timezone.utc)
+    return recorded.timestamp()
+
+# Give a recorded transaction fresh ids, this environment's store and client ids, and the current time
+def refresh_transaction(transaction_data, env_vars):
+    request_payload = transaction_data['request_payload']
+    payments = request_payload.get('payments', [])
+    discounts = request_payload.get('discounts', [])
+    ids = random_uuids(2 + len(payments) + len(discounts))
+    formatted_time = format_transaction_time(datetime.now(timezone.utc))
+
+    transaction_data['store_id'] = env_vars['STORE_ID']
+    transaction_data['client_id'] = env_vars['CLIENT_ID']
+    transaction_data['request_id'] = ids[0]
+    request_payload['transaction_id'] = ids[1]
+    request_payload['open_time'] = formatted_time
+    request_payload['modified_time'] = formatted_time
+    for payment, payment_id in zip(payments, ids[2:]):
+        payment['payment_id'] = payment_id
+        payment['payment_time'] = formatted_time
+    for discount, discount_id in zip(discounts, ids[2 + len(payments):]):
+        discount['discount_id'] = discount_id
+    return transaction_data
+
+# Rebuild a recorded customer as a new user: drop server-assigned fields and make external_id and email unique
+def refresh_customer(user):
+    customer_data = {field: user[field] for field in CUSTOMER_FIELDS if field in user}
+    customer_data['external_id'] = str(uuid.uuid4())
+    local, _, domain = customer_data.get('email', '').partition('@')
+    if domain:
+        customer_data['email'] = f"{local}.{customer_data['external_id'][:8]}@{domain}"
+    return {"user": customer_data}
+
+# Space requests at least 1/rate seconds apart
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# Replay recorded request logs: re-send every customer and transaction with fresh ids,
+# following the recorded inter-arrival timing scaled by speed (None sends as fast as the limits allow)
+async def replay_logs(context, paths, enable_logging, max_in_flight, speed, max_rate):
+    import aiohttp
+    from aiohttp import BasicAuth
+
+    if not context:
+        raise ValueError("--context is required when replaying request logs.")
+    env_vars = load_environment_variables(context)
+    current_context.set(context)
+
+    if enable_logging:
+        logger = setup_logging()
+    else:
+        logger = logging.getLogger(__name__)
+        logger.addHandler(logging.NullHandler())
+
+    auth = BasicAuth(login=env_vars['USERNAME'], password=env_vars['PASSWORD'])
+    api_url = env_vars['HOST'] + f'/priv/v1/apps/{env_vars["USERNAME"]}/users'
+    semaphore = asyncio.Semaphore(max_in_flight)
+    limiter = RateLimiter(max_rate) if max_rate else None
+    counts = {kind: {"sent": 0, "success": 0, "failed": 0} for kind in ('customer', 'transaction')}
+    skipped = 0
+    max_lag = 0.0
+    tasks = set()
+
+    async def dispatch(session, kind, body):
+        try:
+            if kind == 'customer':
+                result = await send_customer(session, refresh_customer(body), auth, api_url, logger)
+            else:
+                result = await send_transaction(session, refresh_transaction(body, env_vars), env_vars['AUTH_TOKEN'],
+                                                env_vars['CLOUDPOS_ENDPOINT'], logger)
+        finally:
+            semaphore.release()
+        counts[kind]["sent"] += 1
+        counts[kind]["success" if result["status"] == 200 else "failed"] += 1
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    first_time = None
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for path in paths:
+            for record in iter_log_records(path):
+                kind, body = classify_record(record)
+                if kind is None:
+                    skipped += 1
+                    continue
+                metrics.plan(f"{kind}s", 1)
+
+                # Hold each request until its recorded offset from the first one, scaled by speed
+                due = None
+                recorded = record_time(kind, body) if speed is not None else None
+                if recorded is not None:
+                    first_time = recorded if first_time is None else first_time
+                    due = start + (recorded - first_time) / speed
+                    delay = due - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                # Waiting for a slot before creating the task keeps memory flat at any speed
+                await semaphore.acquire()
+                if limiter:
+                    await limiter.acquire()
+                if due is not None:
+                    max_lag = max(max_lag, loop.time() - due)
+                task = asyncio.create_task(dispatch(session, kind, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    elapsed = max(loop.time() - start, 1e-9)
+    for kind, kind_counts in counts.items():
+        if kind_counts["sent"]:
+            print(f"Replayed {kind_counts['sent']} {kind}s (success: {kind_counts['success']}, failed: {kind_counts['failed']})")
+    if skipped:
+        print(f"Skipped {skipped} log records that are not customers or transactions")
+    total = sum(kind_counts["sent"] for kind_counts in counts.values())
+    print(f"Replay took {elapsed:.1f}s, {total / elapsed:.0f} requests/s" +
+          (f", max lag behind recorded timing: {max_lag:.2f}s" if speed is not None else ""))
+
+# Main function: stream an exported dataset directory to the APIs, customers first
+async def replay_dataset(context, input_dir, enable_logging, max_in_flight):
+    import aiohttp
+
+    manifest = read_manifest(input_dir)
+    context = context or manifest.get('context')
+    if not context:
+        raise ValueError(f"No --context given and {input_dir} has no manifest naming one.")
+    env_vars = load_environment_variables(context)
+    current_context.set(context)
+
+    if enable_logging:
+        logger = setup_logging()
+    else:
+        logger = logging.getLogger(__name__)
+        logger.addHandler(logging.NullHandler())
+
+    start = time.time()
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        customer_counts = await replay_customers(session, input_dir, env_vars, logger, max_in_flight, new_run_id(context))
+        transaction_counts = await replay_transactions(session, input_dir, env_vars, logger, max_in_flight)
+
+    elapsed = max(time.time() - start, 1e-9)
+    for name, counts in (("customers", customer_counts), ("transactions", transaction_counts)):
+        if counts["sent"]:
+            print(f"Replayed {counts['sent']} {name} (success: {counts['success']}, failed: {counts['failed']})")
+    if customer_counts["skipped"]:
+        print(f"Skipped {customer_counts['skipped']} customers that already exist")
+    if transaction_counts["skipped"]:
+        print(f"Skipped {transaction_counts['skipped']} transactions an earlier replay already sent")
+    print(f"Replay took {elapsed:.1f}s")
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Send a dataset written with --export, or recorded request logs, to the APIs.')
+    parser.add_argument('--input', nargs='+', required=True,
+                        help='A directory written by --export, or one or more request logs (transactions_<ts>.json, '
+                             'generate_customers_<ts>.json or NDJSON).')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'],
+                        help='Context to send to (defaults to the one in the manifest; required for request logs).')
+    parser.add_argument('--speed', type=parse_speed, default=None, metavar='SPEED',
+                        help='Request logs only: replay at a multiple of the recorded timing (1x, 10x, ...) or "max" (default).')
+    parser.add_argument('--maxRate', type=float, help='Request logs only: maximum requests per second.')
+    parser.add_argument('--maxInFlight', type=int, default=50, help='Maximum concurrent requests. Concurrency adapts below this from observed latency and errors.')
+    parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
+    add_run_options(parser, progress='while the replay runs', responses='transaction')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    set_ceiling(args.maxInFlight, 'customers', 'transactions')
+    set_response_mode(args.responses, args.enableLogging, 'transactions')
+    set_gzip(args.gzipRequests, 'customers', 'transactions')
+    if len(args.input) == 1 and os.path.isdir(args.input[0]):
+        return profiled(args.profile, 'replay', recorded('replay', args.context, replay_dataset(
+            args.context, args.input[0], args.enableLogging, args.maxInFlight)))
+    for path in args.input:
+        if not os.path.isfile(path):
+            raise ValueError(f"{path} is not a request log; pass a single export directory or log files.")
+    return profiled(args.profile, 'replay', recorded('replay', args.context, replay_logs(
+        args.context, args.input, args.enableLogging, args.maxInFlight, args.speed, args.maxRate)))
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+from datetime import datetime, timezone
+from metrics import metrics, histogram_percentile
+
+# Every run appends a summary to this SQLite file next to the other logs; `cli.py report` compares them
+LOG_DIR = 'logs'
+HISTORY_FILE = 'run_history.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    context TEXT,
+    host TEXT,
+    started_at TEXT NOT NULL,
+    duration_s REAL,
+    status TEXT,
+    error TEXT,
+    requests INTEGER,
+    success INTEGER,
+    failed INTEGER,
+    requests_per_s REAL,
+    error_rate REAL,
+    p50_ms REAL,
+    p90_ms REAL,
+    p99_ms REAL,
+    kinds TEXT,
+    errors TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_command_context ON runs (command, context, started_at);
+"""
+
+def history_path():
+    return os.path.join(LOG_DIR, HISTORY_FILE)
+
+def connect_history(path=None):
+    path = path or history_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+# What a run added to the process metrics between two Metrics.totals()
+def summarize(before, after, duration):
+    kinds = {}
+    for kind, counts in after['kinds'].items():
+        previous = before['kinds'].get(kind, {})
+        delta = {key: value - previous.get(key, 0) for key, value in counts.items()}
+        if delta['sent']:
+            kinds[kind] = delta
+    errors = {status: count - before['errors'].get(status, 0) for status, count in after['errors'].items()
+              if count > before['errors'].get(status, 0)}
+    histogram = [count - previous for count, previous in zip(after['histogram'], before['histogram'])]
+    requests = sum(counts['sent'] for counts in kinds.values())
+    failed = sum(counts['failed'] for counts in kinds.values())
+    return {
+        'requests': requests,
+        'success': requests - failed,
+        'failed': failed,
+        'requests_per_s': round(requests / duration, 2) if duration > 0 else 0.0,
+        'error_rate': round(failed / requests, 4) if requests else 0.0,
+        'p50_ms': histogram_percentile(histogram, 50),
+        'p90_ms': histogram_percentile(histogram, 90),
+        'p99_ms': histogram_percentile(histogram, 99),
+        'kinds': kinds,
+        'errors': errors,
+    }
+
+def save_run(run, path=None):
+    columns = list(run)
+    values = [json.dumps(run[column], default=str) if isinstance(run[column], (dict, list)) else run[column] for column in columns]
+    connection = connect_history(path)
+    try:
+        with connection:
+            connection.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})", values)
+    finally:
+        connection.close()
+
+# Runs oldest first, optionally for one command and/or context
+def load_runs(path=None, command=None, context=None):
+    query, params = "SELECT * FROM runs", []
+    filters = [(column, value) for column, value in (('command', command), ('context', context)) if value]
+    if filters:
+        query += " WHERE " + " AND ".join(f"{column} = ?" for column, _ in filters)
+        params = [value for _, value in filters]
+    connection = connect_history(path)
+    try:
+        rows = connection.execute(query + " ORDER BY started_at, id", params).fetchall()
+    finally:
+        connection.close()
+    runs = []
+    for row in rows:
+        run = dict(row)
+        for column in ('kinds', 'errors', 'result'):
+            run[column] = json.loads(run[column]) if run[column] else None
+        runs.append(run)
+    return runs
+
+# Await a script's coroutine and append its summary to the run history, whether it finishes or fails
+# The counts are the requests the process sent while the run was going, so runs that overlap in one process
+# (e.g. scheduled jobs that run long) include each other's requests
+async def recorded(command, context, coro):
+    before = metrics.totals()
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    status, error, result = 'ok', None, None
+    try:
+        result = await coro
+        return result
+    except BaseException as e:
+        status, error = 'failed', f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        run = {'command': command, 'context': context, 'host': socket.gethostname(), 'started_at': started_at.isoformat(),
+               'duration_s': round(duration, 3), 'status': status, 'error': error,
+               **summarize(before, metrics.totals(), duration),
+               'result': result if isinstance(result, dict) else None}
+        try:
+            save_run(run)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not record the run in {history_path()}: {e}")
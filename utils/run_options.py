@@ -0,0 +1,21 @@
+from profiling import PROFILE_MODES
+from http_policy import RESPONSE_MODES
+from status_server import DEFAULT_HOST
+
+# Add the flags the commands share, so their help reads the same everywhere:
+# progress - when the live status server applies (e.g. 'while the backfill runs'); adds --statusPort and --statusHost
+# responses - the kind of response --responses applies to (e.g. 'transaction'); adds --responses and --gzipRequests
+# Every command gets --profile
+def add_run_options(parser, progress=None, responses=None):
+    if progress:
+        parser.add_argument('--statusPort', type=int, help=f'Serve live progress on this port {progress}.')
+        parser.add_argument('--statusHost', default=DEFAULT_HOST,
+                            help='Address the status server binds to (default %(default)s, this machine only). Use 0.0.0.0 to serve it on every interface, e.g. in Docker.')
+    if responses:
+        parser.add_argument('--responses', choices=RESPONSE_MODES,
+                            help=f'How much of each {responses} response to read: status (the default), headers or body (the default with --enableLogging).')
+        parser.add_argument('--gzipRequests', action='store_true', help='Gzip request bodies. The APIs must accept Content-Encoding: gzip.')
+    parser.add_argument('--profile', nargs='?', const='stages', choices=PROFILE_MODES,
+                        help='Time the generate, encode, send and persist stages and write a breakdown and stack samples to logs/. '
+                             'cprofile, tracemalloc or all also capture a function profile and allocations.')
+    return parser
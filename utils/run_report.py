@@ -0,0 +1,83 @@
+import sys
+import os
+import argparse
+import asyncio
+import statistics
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from run_history import history_path, load_runs
+
+# Runs smaller or shorter than this have too few requests for their throughput to be compared
+MIN_REQUESTS = 200
+MIN_SECONDS = 5.0
+
+# Compare each run's throughput with the median of the runs of the same command and context before it
+# Runs that failed, or sent fewer than min_requests requests or ran for less than min_seconds, are listed
+# but neither compared nor used as a baseline
+def find_regressions(runs, baseline_size, threshold, min_requests=MIN_REQUESTS, min_seconds=MIN_SECONDS):
+    history = {}
+    for run in runs:
+        previous = history.setdefault((run['command'], run['context']), [])
+        run['baseline_per_s'] = run['change'] = None
+        run['regression'] = False
+        run['insufficient'] = run['status'] == 'ok' and (run['requests'] < min_requests or run['duration_s'] < min_seconds)
+        if run['status'] != 'ok' or run['insufficient']:
+            continue
+        if previous:
+            baseline = statistics.median(previous[-baseline_size:])
+            run['baseline_per_s'] = round(baseline, 2)
+            run['change'] = run['requests_per_s'] / baseline - 1 if baseline else None
+            run['regression'] = run['change'] is not None and run['change'] < -threshold
+        previous.append(run['requests_per_s'])
+    return runs
+
+def print_runs(runs):
+    print(f"{'started (UTC)':<20}{'command':<21}{'context':<9}{'status':<8}{'duration':>10}{'requests':>10}{'req/s':>9}"
+          f"{'baseline':>10}{'change':>8}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for run in runs:
+        change = f"{run['change']:+.0%}" if run['change'] is not None else '-'
+        baseline = f"{run['baseline_per_s']:.1f}" if run['baseline_per_s'] is not None else '-'
+        p50 = f"{run['p50_ms']:.1f}" if run['p50_ms'] is not None else '-'
+        p99 = f"{run['p99_ms']:.1f}" if run['p99_ms'] is not None else '-'
+        print(f"{run['started_at'][:19].replace('T', ' '):<20}{run['command']:<21}{run['context'] or '-':<9}{run['status']:<8}"
+              f"{run['duration_s']:>9.1f}s{run['requests']:>10}{run['requests_per_s']:>9.1f}{baseline:>10}{change:>8}"
+              f"{p50:>9}{p99:>9}{run['error_rate']:>8.1%}" +
+              ('  REGRESSION' if run['regression'] else '  insufficient data' if run['insufficient'] else ''))
+
+async def report(history, command, context, last, baseline_size, threshold, fail_on_regression, min_requests, min_seconds):
+    runs = find_regressions(load_runs(history, command, context), baseline_size, threshold, min_requests, min_seconds)
+    if not runs:
+        print(f"No runs recorded in {history}.")
+        return
+    recent = runs[-last:]
+    print_runs(recent)
+    regressions = [run for run in recent if run['regression']]
+    print(f"{len(regressions)} of {len(recent)} runs more than {threshold:.0%} below the median throughput of up to "
+          f"{baseline_size} earlier runs of the same command and context")
+    insufficient = sum(run['insufficient'] for run in recent)
+    if insufficient:
+        print(f"{insufficient} runs not compared: fewer than {min_requests} requests or shorter than {min_seconds:g}s")
+    if regressions and fail_on_regression:
+        raise SystemExit(1)
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Compare recent runs from the run history and flag throughput regressions.')
+    parser.add_argument('--command', help='Only runs of this command (customers, txns, backfill, ...).')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], help='Only runs for this context.')
+    parser.add_argument('--last', type=int, default=20, help='Number of recent runs to list.')
+    parser.add_argument('--baseline', type=int, default=5, help='Earlier runs of the same command and context whose median throughput a run is compared with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Flag runs whose throughput is this fraction or more below the baseline.')
+    parser.add_argument('--minRequests', type=int, default=MIN_REQUESTS, help='Runs with fewer requests are not compared or used as a baseline.')
+    parser.add_argument('--minSeconds', type=float, default=MIN_SECONDS, help='Runs shorter than this are not compared or used as a baseline.')
+    parser.add_argument('--history', default=history_path(), help='Run history file.')
+    parser.add_argument('--failOnRegression', action='store_true', help='Exit with status 1 if a listed run is a regression.')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    return report(args.history, args.command, args.context, args.last, args.baseline, args.threshold, args.failOnRegression,
+                  args.minRequests, args.minSeconds)
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,143 @@
+import math
+import heapq
+import random
+import itertools
+from datetime import datetime, timezone
+
+# Strategies accepted by sample_collection (and the --sampling argument of the scripts)
+SAMPLING_STRATEGIES = ['newest', 'uniform', 'reservoir', 'recency', 'stratified']
+
+# Draw a uniform random number in the open interval (0, 1)
+def _open_uniform(rng):
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+# Normalize a Mongo timestamp (naive UTC datetime or ISO string) to an aware datetime
+def _as_utc(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+# Add a field to an inclusion projection
+def _include(projection, field):
+    projection[field] = 1
+    return projection
+
+# Fields an inclusion projection returns
+def _fields(projection):
+    return [field for field, value in projection.items() if value and field != '_id']
+
+# Uniform sample of k items from an in-memory sequence, O(k)
+def uniform_sample(population, k, rng=random):
+    return rng.sample(population, max(0, min(k, len(population))))
+
+# Uniform sample of k items from an iterable of unknown length (e.g. a Mongo cursor)
+# Uses Algorithm L: one pass, O(k) memory, O(k(1 + log(n/k))) random draws
+def reservoir_sample(iterable, k, rng=random):
+    if k <= 0:
+        return []
+    iterator = iter(iterable)
+    reservoir = list(itertools.islice(iterator, k))
+    if len(reservoir) < k:
+        return reservoir
+
+    w = math.exp(math.log(_open_uniform(rng)) / k)
+    sentinel = object()
+    while True:
+        skip = int(math.log(_open_uniform(rng)) / math.log(1 - w))
+        item = next(itertools.islice(iterator, skip, skip + 1), sentinel)
+        if item is sentinel:
+            return reservoir
+        reservoir[rng.randrange(k)] = item
+        w *= math.exp(math.log(_open_uniform(rng)) / k)
+
+# Weighted sample of k items favouring recent timestamps (Efraimidis-Spirakis A-Res)
+# An item's weight halves every half_life_days; one pass, O(k) memory
+def recency_weighted_sample(iterable, k, timestamp_key, half_life_days=30, now=None, rng=random):
+    if k <= 0:
+        return []
+    now = now or datetime.now(timezone.utc)
+    heap = []
+    for index, item in enumerate(iterable):
+        timestamp = timestamp_key(item)
+        if timestamp is None:
+            weight = 1e-12
+        else:
+            age_days = max(0.0, (now - _as_utc(timestamp)).total_seconds() / 86400)
+            weight = max(0.5 ** (age_days / half_life_days), 1e-12)
+        key = math.log(_open_uniform(rng)) / weight
+        if len(heap) < k:
+            heapq.heappush(heap, (key, index, item))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, index, item))
+    return [item for _, _, item in heap]
+
+# Split k across segments in proportion to their size (largest remainder method)
+def allocate_strata(segment_counts, k):
+    total = sum(segment_counts.values())
+    if total == 0 or k <= 0:
+        return {segment: 0 for segment in segment_counts}
+    k = min(k, total)
+    exact = {segment: k * count / total for segment, count in segment_counts.items()}
+    allocation = {segment: int(share) for segment, share in exact.items()}
+    remaining = k - sum(allocation.values())
+    for segment in sorted(exact, key=lambda s: exact[s] - allocation[s], reverse=True)[:remaining]:
+        allocation[segment] += 1
+    return allocation
+
+# Stratified sample of k items, proportional to segment_counts, with one reservoir per segment
+def stratified_sample(iterable, k, segment_key, segment_counts, rng=random):
+    allocation = allocate_strata(segment_counts, k)
+    reservoirs = {segment: [] for segment in allocation}
+    seen = dict.fromkeys(allocation, 0)
+    for item in iterable:
+        segment = segment_key(item)
+        quota = allocation.get(segment, 0)
+        if not quota:
+            continue
+        seen[segment] += 1
+        reservoir = reservoirs[segment]
+        if len(reservoir) < quota:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(seen[segment])
+            if j < quota:
+                reservoir[j] = item
+    return [item for reservoir in reservoirs.values() for item in reservoir]
+
+# Sample k documents from a Mongo collection into a Population (see population.py)
+# projection is an inclusion projection naming the fields to keep; context gives missing personas their default.
+# newest and uniform run in MongoDB ($sample); reservoir, recency and stratified stream a projected cursor through
+# the O(k) samplers above. Either way only the k sampled documents are held in memory and packed.
+def sample_collection(collection, strategy, k, query=None, projection=None, context=None, segment_field='is_anomalous', rng=random):
+    from population import Population
+
+    query = query or {}
+    projection = dict(projection or {'_id': 0, 'user_id': 1, 'external_id': 1, 'persona': 1})
+    fields = _fields(projection)
+    if k <= 0:
+        return Population.from_documents([], fields, context)
+
+    if strategy == 'newest':
+        documents = collection.find(query, projection).sort('timestamp', -1).limit(k)
+    elif strategy == 'uniform':
+        documents = collection.aggregate([{'$match': query}, {'$sample': {'size': k}}, {'$project': projection}])
+    elif strategy == 'reservoir':
+        documents = reservoir_sample(collection.find(query, projection), k, rng)
+    elif strategy == 'recency':
+        documents = recency_weighted_sample(collection.find(query, _include(dict(projection), 'timestamp')), k,
+                                            lambda doc: doc.get('timestamp'), rng=rng)
+    elif strategy == 'stratified':
+        counts = {row['_id']: row['count'] for row in collection.aggregate([
+            {'$match': query},
+            {'$group': {'_id': f'${segment_field}', 'count': {'$sum': 1}}}
+        ])}
+        documents = stratified_sample(collection.find(query, _include(dict(projection), segment_field)), k,
+                                      lambda doc: doc.get(segment_field), counts, rng)
+    else:
+        raise ValueError(f"Unknown sampling strategy: {strategy}")
+    return Population.from_documents(documents, fields, context)
@@ -1,59 +1,160 @@
+import sys
 import logging
 import os
-import subprocess
 import asyncio
 import signal
-from datetime import datetime, time
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.interval import IntervalTrigger
+import random
+from collections import deque
+from datetime import datetime, time, timezone
 import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import cli
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from status_server import start_status_server
+from job_queue import MAX_CHUNK_SIZE
+from targets import new_run_id
+from idempotency import stable_seed
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
+from concurrency import DEFAULT_CEILING, set_ceiling
+from http_policy import set_gzip, set_response_mode
 
 # Setup logging
 LOG_DIR = 'logs'
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(filename=os.path.join(LOG_DIR, 'scheduler.log'), level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
-async def run_script(script_path, enable_logging, context):
-    start_time = datetime.now()
-    logging.info(f"Job {script_path} with context '{context}' started at: {start_time}")
-    print(f"Job {script_path} with context '{context}' started at: {start_time}")
-
-    try:
-        cmd = f"python3 {script_path} --context {context}"
-        if enable_logging:
-            cmd += " --enableLogging"
-
-        result = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout, stderr = await result.communicate()
-
-        end_time = datetime.now()
-        logging.info(f"Job {script_path} with context '{context}' completed successfully at: {end_time}")
-        logging.info(f"Job duration for {script_path}: {end_time - start_time}")
-        logging.info(f"Job output for {script_path}: {stdout.decode()}")
-        logging.info(f"Job error (if any) for {script_path}: {stderr.decode()}")
-
-        print(f"Job {script_path} with context '{context}' completed successfully at: {end_time}")
-        print(f"Job duration for {script_path}: {end_time - start_time}")
-    except Exception as e:
-        end_time = datetime.now()
-        logging.error(f"Job {script_path} with context '{context}' failed at: {end_time}")
-        logging.error(f"Job duration for {script_path}: {end_time - start_time}")
-        logging.error(f"Job error for {script_path}: {str(e)}")
-
-        print(f"Job {script_path} with context '{context}' failed at: {end_time}")
-        print(f"Job duration for {script_path}: {end_time - start_time}")
-        print(f"Job error for {script_path}: {str(e)}")
-
-async def run_jobs(context, enable_logging):
-    script_path = "generate-customers/generate_customers.py"
-    await run_script(script_path, enable_logging, context)
+
+def setup_logging():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(LOG_DIR, 'scheduler.log'), level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Runs of each context start at their own minute past the hour (from a hash of the context) plus up to this many
+# seconds, so schedulers for several demo environments do not all send at :00
+START_JITTER_SECONDS = 300
+
+# Customers per run: the live range of generate_and_send_data, capped by --maxCustomers and the run's budget
+MIN_CUSTOMERS = 50
+MAX_CUSTOMERS = 250
+
+# A run's customers are sent in batches of this size spread evenly across its budget instead of in one burst
+SPREAD_BATCH_SIZE = 25
+
+# Recent runs whose sending time per customer sizes the next run
+RECENT_RUNS = 10
+
+# Share of the budget a run plans to fill, leaving room for batches slower than the recent ones
+BUDGET_HEADROOM = 0.8
+
+# Fire times missed by up to this long (while a run is going, or the process was paused) still run; several
+# missed fire times of one job are coalesced into a single run
+MISFIRE_GRACE_SECONDS = 15 * 60
+
+def log(message, level=logging.INFO):
+    logging.log(level, message)
+    print(message)
+
+# Customer generation runs for the scheduler's jobs, one at a time
+# The immediate_job, hourly_job_today and hourly_job triggers can fire together; a trigger that fires while a run
+# is going is coalesced into that run instead of overlapping it. Each run is sized from the recent sending time per
+# customer so that it fits its budget (--budgetMinutes, or the time until the next fire time if that is sooner),
+# and its customers are sent in batches spread across that time. The batches share a run_id and number their
+# customers from their offset, like job queue chunks, so the last-run target sees one run. Each run is recorded in
+# the run history as customers-scheduled, since its throughput is set by the spreading rather than the API.
+class ScheduledRuns:
+    def __init__(self, context, enable_logging, locale, max_customers, budget_seconds, max_in_flight=DEFAULT_CEILING,
+                 responses=None, gzip_requests=False):
+        self.context = context
+        self.enable_logging = enable_logging
+        self.locale = locale
+        self.max_customers = max_customers
+        self.budget_seconds = budget_seconds
+        self.max_in_flight = max_in_flight
+        self.responses = responses
+        self.gzip_requests = gzip_requests
+        self.scheduler = None
+        self.running = None
+        self.recent = deque(maxlen=RECENT_RUNS)
+
+    # Seconds spent sending per customer over the recent runs (None before the first run)
+    def seconds_per_customer(self):
+        customers = sum(count for count, _ in self.recent)
+        return sum(seconds for _, seconds in self.recent) / customers if customers else None
+
+    # Customers for the next run and the seconds it may take
+    def plan(self, now):
+        available = self.budget_seconds
+        next_run_times = [job.next_run_time for job in self.scheduler.get_jobs() if job.next_run_time]
+        if next_run_times:
+            available = min(available, (min(next_run_times) - now).total_seconds())
+        cap = min(MAX_CUSTOMERS, self.max_customers)
+        count = random.randint(min(MIN_CUSTOMERS, cap), cap)
+        per_customer = self.seconds_per_customer()
+        if per_customer:
+            count = min(count, int(max(available, 0) * BUDGET_HEADROOM / per_customer))
+        return count, available
+
+    async def run(self, job_id):
+        if self.running:
+            log(f"Job {job_id} with context '{self.context}' skipped: coalesced into {self.running}, which is still running")
+            return
+        self.running = job_id
+        try:
+            await self._run(job_id)
+        finally:
+            self.running = None
+
+    async def _run(self, job_id):
+        start_time = datetime.now(timezone.utc)
+        count, available = self.plan(start_time)
+        if count < 1:
+            log(f"Job {job_id} with context '{self.context}' skipped: its {max(available, 0):.0f}s budget is too short for one customer",
+                logging.WARNING)
+            return
+        log(f"Job {job_id} with context '{self.context}' started at: {start_time} "
+            f"({count} customers spread over {available * BUDGET_HEADROOM / 60:.1f} minutes)")
+
+        # The same setup as the customers command, applied per run so other commands in the process cannot change it
+        set_ceiling(self.max_in_flight, 'customers', 'transactions')
+        set_response_mode(self.responses, self.enable_logging, 'transactions')
+        set_gzip(self.gzip_requests, 'customers', 'transactions')
+        try:
+            result = await recorded('customers-scheduled', self.context, self._send(count, available))
+            created, sending = result["customers"], result["sending_s"]
+            self.recent.append((count, sending))
+
+            end_time = datetime.now(timezone.utc)
+            log(f"Job {job_id} with context '{self.context}' completed successfully at: {end_time}")
+            log(f"Job duration for {job_id}: {end_time - start_time} (sending: {sending:.1f}s, customers created: {created}, "
+                f"recent: {self.seconds_per_customer() * 1000:.0f} ms per customer)")
+            if (end_time - start_time).total_seconds() > available:
+                log(f"Job {job_id} with context '{self.context}' ran over its {available:.0f}s budget", logging.WARNING)
+        except (Exception, SystemExit) as e:
+            end_time = datetime.now(timezone.utc)
+            log(f"Job {job_id} with context '{self.context}' failed at: {end_time}", logging.ERROR)
+            log(f"Job duration for {job_id}: {end_time - start_time}", logging.ERROR)
+            log(f"Job error for {job_id}: {str(e)}", logging.ERROR)
+
+    # Send a run's customers in batches spread evenly across its budget
+    async def _send(self, count, available):
+        # Loaded through the CLI so its imports are only paid on the first run
+        module = cli.load_command('customers')
+        run_id = new_run_id(self.context)
+        offsets = range(0, count, SPREAD_BATCH_SIZE)
+        interval = available * BUDGET_HEADROOM / len(offsets)
+        loop = asyncio.get_running_loop()
+        run_start = loop.time()
+        created = 0
+        sending = 0.0
+        for index, offset in enumerate(offsets):
+            delay = run_start + index * interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            batch_start = loop.time()
+            result = await module.main(self.context, False, self.enable_logging, self.locale,
+                                       count=min(SPREAD_BATCH_SIZE, count - offset), run_id=run_id, sequence_start=offset)
+            sending += loop.time() - batch_start
+            created += result["customers"] if result else 0
+        return {"run_id": run_id, "customers": created, "sending_s": round(sending, 3)}
 
 def print_next_run_times(scheduler):
     jobs = scheduler.get_jobs()
@@ -65,31 +166,36 @@ def print_next_run_times(scheduler):
     else:
         print("No scheduled jobs.")
 
-def shutdown(signum, frame):
+def shutdown(scheduler):
     logging.info("Scheduler is shutting down...")
     print("Scheduler is shutting down...")
     scheduler.shutdown(wait=False)
-    asyncio.get_event_loop().stop()
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Scheduler for running generate_customers.py script.')
-    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
-    parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
 
-    args = parser.parse_args()
+# Start the scheduler and keep it running until SIGINT/SIGTERM
+async def start_scheduler(context, enable_logging, locale, max_customers, budget_minutes, max_in_flight=DEFAULT_CEILING,
+                          responses=None, gzip_requests=False):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
 
-    scheduler = AsyncIOScheduler()
+    setup_logging()
+    runs = ScheduledRuns(context, enable_logging, locale, max_customers, budget_minutes * 60, max_in_flight, responses, gzip_requests)
+    scheduler = runs.scheduler = AsyncIOScheduler(job_defaults={'coalesce': True, 'max_instances': 1,
+                                                                'misfire_grace_time': MISFIRE_GRACE_SECONDS})
+    start_minute = stable_seed('scheduler', context) % 60
 
     # Schedule the job to run immediately
-    scheduler.add_job(run_jobs, args=[args.context, args.enableLogging], id='immediate_job')
+    scheduler.add_job(runs.run, args=['immediate_job'], id='immediate_job')
 
     # Schedule the job to run once every hour after the initial run until 17:00 UTC
     now = datetime.utcnow()
     if now.time() < time(17, 0):
-        scheduler.add_job(run_jobs, IntervalTrigger(hours=1, start_date=now, end_date=datetime.combine(now.date(), time(17, 0))), args=[args.context, args.enableLogging], id='hourly_job_today')
+        scheduler.add_job(runs.run, IntervalTrigger(hours=1, start_date=now, end_date=datetime.combine(now.date(), time(17, 0)),
+                                                    jitter=START_JITTER_SECONDS), args=['hourly_job_today'], id='hourly_job_today')
 
-    # Schedule the job to run once every hour between 09:00 and 17:00 UTC, every day of the week
-    scheduler.add_job(run_jobs, CronTrigger(minute='0', hour='9-17', timezone='UTC'), args=[args.context, args.enableLogging], id='hourly_job')
+    # Schedule the job to run once every hour between 09:00 and 17:00 UTC, every day of the week, at the context's minute
+    scheduler.add_job(runs.run, CronTrigger(minute=start_minute, hour='9-17', timezone='UTC', jitter=START_JITTER_SECONDS),
+                      args=['hourly_job'], id='hourly_job')
 
     scheduler.start()
     logging.info("Scheduler started")
@@ -98,11 +204,43 @@ if __name__ == "__main__":
     print_next_run_times(scheduler)
 
     # Register signal handlers for graceful shutdown
-    signal.signal(signal.SIGINT, shutdown)
-    signal.signal(signal.SIGTERM, shutdown)
-
-    # Keep the script running
-    try:
-        asyncio.get_event_loop().run_forever()
-    except (KeyboardInterrupt, SystemExit):
-        shutdown(None, None)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    # Keep the scheduler running
+    await stop_event.wait()
+    shutdown(scheduler)
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Scheduler for running generate_customers.py script.')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context for the data.')
+    parser.add_argument('--locale', choices=['en_US', 'es_MX', 'pt_PT'], default='en_US', help='Locale passed to generate_customers.py.')
+    parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
+    parser.add_argument('--maxCustomers', type=int, default=MAX_CUSTOMERS, help=f'Most customers per run (max {MAX_CHUNK_SIZE}).')
+    parser.add_argument('--budgetMinutes', type=float, default=20.0,
+                        help='How long each run may take. Runs are sized from recent runs to fit and their customers are spread across it.')
+    parser.add_argument('--maxInFlight', type=int, default=DEFAULT_CEILING, help='Maximum concurrent requests to each API. Concurrency adapts below this from observed latency and errors.')
+    add_run_options(parser, progress='while the scheduled jobs run', responses='transaction')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if not 1 <= args.maxCustomers <= MAX_CHUNK_SIZE:
+        raise ValueError(f"--maxCustomers must be between 1 and {MAX_CHUNK_SIZE}.")
+    if args.budgetMinutes <= 0:
+        raise ValueError("--budgetMinutes must be positive.")
+    if args.maxInFlight < 1:
+        raise ValueError("--maxInFlight must be at least 1.")
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    # Each scheduled run is recorded in the run history on its own; the scheduler's lifetime is not a run
+    return profiled(args.profile, 'scheduler', start_scheduler(
+        args.context, args.enableLogging, args.locale, args.maxCustomers, args.budgetMinutes,
+        args.maxInFlight, args.responses, args.gzipRequests))
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
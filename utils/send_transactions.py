@@ -1,16 +1,17 @@
 import os
 import json
 import uuid
-import random
 import asyncio
-import aiohttp
-from aiohttp import BasicAuth
-from dotenv import load_dotenv
 import logging
 from datetime import datetime, timezone
+from metrics import metrics, current_context
+from concurrency import TrackedRequest, unbounded_connector
+from profiling import profiler
+from http_policy import encode_body, read_response
 
 # Load and define environment variables based on argument
 def load_environment_variables(context):
+    from dotenv import load_dotenv
     load_dotenv()
     env_vars = {
         'CLOUDPOS_ENDPOINT': os.getenv(f'{context.upper()}_CLOUDPOS_ENDPOINT'),
@@ -35,95 +36,173 @@ def setup_logging():
     return logger
 
 # Function to send transaction to the REST API asynchronously
+# The response body is only read when the transactions response mode keeps it (see http_policy.py)
 async def send_transaction(session, transaction_data, auth, endpoint, logger):
+    import aiohttp
+    with profiler.stage("encode"):
+        body, encoding_headers = encode_body("transactions", transaction_data)
     headers = {
         'Content-Type': 'application/json',
-        'Authorization': f'Basic {auth}'
+        'Authorization': f'Basic {auth}',
+        **encoding_headers
     }
-    try:
-        async with session.post(endpoint, headers=headers, json=transaction_data) as response:
-            status = response.status
-            response_text = await response.text()
-            logger.info(f"Transaction Response Status: {status}, Response Text: {response_text}")
-            return {"status": status, "response": response_text, "request_body": transaction_data}
-    except aiohttp.ClientError as e:
-        logger.error(f"Client error: {e}")
-        return {"status": "error", "response": str(e), "request_body": transaction_data}
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return {"status": "error", "response": str(e), "request_body": transaction_data}
-
-# Function to generate transaction data
-def generate_transaction_data(user_id, context, env_vars):
-    store_id = env_vars['STORE_ID']
-    client_id = env_vars['CLIENT_ID']
-
-    # Get current UTC time
-    current_utc_time = datetime.now(timezone.utc)
-    # Format the time to JavaScript JSON date-time format (yyyy-MM-ddTHH:mm:ss.fffZ)
-    formatted_time = current_utc_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-
-    # Generate random values for monetary amounts
-    amount = float(random.randint(10, 100))
-    unit_price = amount
-    subtotal = amount
-
-    channel = random.choice(["IN-STORE", "MOBILE"])
-    payment_type = random.choice(["Credit", "Cash", "Gift Card"])
-
+    async with TrackedRequest("transactions") as request:
+        try:
+            async with session.post(endpoint, headers=headers, data=body) as response:
+                status = request.status = response.status
+                response_text = await read_response("transactions", response)
+                logger.info(f"Transaction Response Status: {status}, Response Text: {response_text}")
+                return {"status": status, "response": response_text, "request_body": transaction_data}
+        except aiohttp.ClientError as e:
+            logger.error(f"Client error: {e}")
+            return {"status": "error", "response": str(e), "request_body": transaction_data}
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            return {"status": "error", "response": str(e), "request_body": transaction_data}
+
+# Send many transactions over one session with at most max_in_flight requests outstanding
+# Returns the results in the same order as transactions
+async def send_transaction_batch(session, transactions, auth, endpoint, logger, max_in_flight):
+    metrics.plan("transactions", len(transactions))
+    results = [None] * len(transactions)
+    next_index = iter(range(len(transactions)))
+
+    async def worker():
+        for index in next_index:
+            results[index] = await send_transaction(session, transactions[index], auth, endpoint, logger)
+
+    await asyncio.gather(*(worker() for _ in range(min(max_in_flight, len(transactions)))))
+    return results
+
+# Transaction type reported to CloudPOS for each context
+TRANSACTION_TYPES = {
+    "retail": "RETAIL_SALE",
+    "qsr": "QSR_SALE",
+    "fuel": "FUEL_SALE",
+}
+
+# Format a UTC time in JavaScript JSON date-time format (yyyy-MM-ddTHH:mm:ss.fffZ)
+def format_transaction_time(utc_time):
+    return utc_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+# Format many epoch-second timestamps at once in the same format as format_transaction_time
+def format_transaction_times(epoch_seconds):
+    import numpy as np
+    milliseconds = np.rint(np.asarray(epoch_seconds, dtype=np.float64) * 1000).astype('int64').astype('datetime64[ms]')
+    return [f"{value}Z" for value in np.datetime_as_string(milliseconds, unit='ms').tolist()]
+
+# Generate count random (version 4) UUID strings from a single urandom read
+# With a seeded numpy Generator the same UUIDs come back every time, so a retried batch keeps its request ids
+def random_uuids(count, rng=None):
+    import numpy as np
+    raw_bytes = rng.bytes(16 * count) if rng is not None else os.urandom(16 * count)
+    raw = np.frombuffer(raw_bytes, dtype=np.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hex_digits = raw.tobytes().hex()
+    return [
+        f"{hex_digits[i:i + 8]}-{hex_digits[i + 8:i + 12]}-{hex_digits[i + 12:i + 16]}-{hex_digits[i + 16:i + 20]}-{hex_digits[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ]
+
+# Build one transaction payload from pre-drawn field values and a priced basket
+def build_transaction_payload(user_id, context, env_vars, formatted_time, channel, payment_type, pos_employee_id,
+                              items, subtotal, tax_total, discounts, total,
+                              request_id=None, transaction_id=None, payment_id=None):
     transaction_data = {
-        "store_id": store_id,
-        "client_id": client_id,
-        "request_id": str(uuid.uuid4()),
+        "store_id": env_vars['STORE_ID'],
+        "client_id": env_vars['CLIENT_ID'],
+        "request_id": request_id or str(uuid.uuid4()),
         "request_payload": {
             "is_closed": True,
             "is_voided": False,
             "channel": channel,
-            "pos_employee_id": "234234",
-            "transaction_id": str(uuid.uuid4()),
+            "pos_employee_id": pos_employee_id,
+            "transaction_id": transaction_id or str(uuid.uuid4()),
             "guest_count": 1,
             "subtotal": subtotal,
-            "tax_total": 0.00,
+            "tax_total": tax_total,
             "open_time": formatted_time,
             "modified_time": formatted_time,
-            "items": [
-                {
-                    "line_id": "1",
-                    "item_id": "008884303989M",
-                    "quantity": 1,
-                    "unit_price": unit_price,
-                    "subtotal": subtotal,
-                    "tax_included": 0
-                }
-            ],
+            "items": items,
             "payments": [
                 {
-                    "payment_id": str(uuid.uuid4()),
-                    "amount": amount,
+                    "payment_id": payment_id or str(uuid.uuid4()),
+                    "amount": total,
                     "type": payment_type,
                     "payment_time": formatted_time,
                     "user_id": user_id,
                     "user_id_type": "External_ID"
                 }
             ],
-            "discounts": []
+            "discounts": discounts
         }
     }
 
-    if context == "retail":
-        transaction_data["request_payload"]["transaction_type"] = "RETAIL_SALE"
-    elif context == "qsr":
-        transaction_data["request_payload"]["transaction_type"] = "QSR_SALE"
-    elif context == "fuel":
-        transaction_data["request_payload"]["transaction_type"] = "FUEL_SALE"
+    if context in TRANSACTION_TYPES:
+        transaction_data["request_payload"]["transaction_type"] = TRANSACTION_TYPES[context]
 
     return transaction_data
 
+# Generate a batch of transactions, one per user, with fields drawn from each user's persona
+# and multi-item baskets drawn from the context's product catalog
+# personas is aligned with user_ids (documents, or columns from a Population); missing entries fall back to the context's default persona
+# timestamps (epoch seconds, aligned with user_ids) back-date transactions; by default they are stamped now
+# id_rng (a seeded numpy Generator) makes the request, transaction, payment and discount ids reproducible
+@profiler.staged("generate")
+def generate_transactions(user_ids, context, env_vars, personas=None, rng=None, timestamps=None, id_rng=None):
+    from personas import draw_transaction_fields
+    from catalog import load_catalog
+
+    personas = personas if personas is not None else [None] * len(user_ids)
+    fields = draw_transaction_fields(personas, context, rng)
+    baskets = load_catalog(context).sample_baskets(fields['amount'], fields['basket_size'], rng)
+    count = len(user_ids)
+    if timestamps is None:
+        formatted_times = [format_transaction_time(datetime.now(timezone.utc))] * count
+    else:
+        formatted_times = format_transaction_times(timestamps)
+    ids = random_uuids(4 * count, id_rng) if count else []
+
+    offsets = baskets['offsets']
+    item_ids, quantities = baskets['item_ids'], baskets['quantities']
+    unit_prices, line_subtotals = baskets['unit_prices'], baskets['line_subtotals']
+
+    transactions = []
+    for i, user_id in enumerate(user_ids):
+        items = [
+            {
+                "line_id": str(line - offsets[i] + 1),
+                "item_id": item_ids[line],
+                "quantity": quantities[line],
+                "unit_price": unit_prices[line],
+                "subtotal": line_subtotals[line],
+                "tax_included": 0
+            }
+            for line in range(offsets[i], offsets[i + 1])
+        ]
+        discount = baskets['discount'][i]
+        discounts = [{"discount_id": ids[3 * count + i], "name": "Promotion", "amount": discount}] if discount else []
+        transactions.append(build_transaction_payload(
+            user_id, context, env_vars, formatted_times[i], fields['channel'][i], fields['payment_type'][i], fields['pos_employee_id'][i],
+            items, baskets['subtotal'][i], baskets['tax'][i], discounts, baskets['total'][i],
+            ids[i], ids[count + i], ids[2 * count + i]
+        ))
+    return transactions
+
+# Function to generate transaction data for a single user
+def generate_transaction_data(user_id, context, env_vars, persona=None):
+    return generate_transactions([user_id], context, env_vars, [persona])[0]
+
 # Main function to send transactions
-async def send_transactions(user_ids, context, enable_logging):
+# With burst > 1, user_ids holds each user's burst back to back: a user's transactions are sent one after another
+# (different users' bursts still go out concurrently), and after_burst(user_id) is called once a burst has been sent
+async def send_transactions(user_ids, context, enable_logging, personas=None, burst=1, after_burst=None):
+    import aiohttp
     env_vars = load_environment_variables(context)
     endpoint = env_vars['CLOUDPOS_ENDPOINT']
     auth_token = env_vars['AUTH_TOKEN']
+    current_context.set(context)
 
     if enable_logging:
         logger = setup_logging()
@@ -131,15 +210,21 @@ async def send_transactions(user_ids, context, enable_logging):
         logger = logging.getLogger(__name__)
         logger.addHandler(logging.NullHandler())
 
-    # --------------------------- VERY IMPORTANT SETTING  ---------------------------
-    # This determines the percentage of new customers that send a first transactions
-    # Generally, we do not want 100% of new customers to send a transaction
-    sample_size = int(len(user_ids) * 0.4)
-    sample_user_ids = random.sample(user_ids, sample_size)
-
-    async with aiohttp.ClientSession() as session:
-        tasks = [send_transaction(session, generate_transaction_data(user_id, context, env_vars), auth_token, endpoint, logger) for user_id in sample_user_ids]
-        results = await asyncio.gather(*tasks)
+    # Sends exactly one transaction per entry in user_ids; callers choose who to sample (see sampling.py)
+    async with aiohttp.ClientSession(connector=unbounded_connector()) as session:
+        transactions = generate_transactions(user_ids, context, env_vars, personas)
+        metrics.plan("transactions", len(transactions))
+
+        async def send_burst(start):
+            burst_results = []
+            for transaction_data in transactions[start:start + burst]:
+                burst_results.append(await send_transaction(session, transaction_data, auth_token, endpoint, logger))
+            if after_burst:
+                after_burst(user_ids[start])
+            return burst_results
+
+        bursts = await asyncio.gather(*(send_burst(start) for start in range(0, len(transactions), max(burst, 1))))
+        results = [result for burst_results in bursts for result in burst_results]
         logger.info("Full results from asyncio.gather:")
         for result in results:
             logger.info(result)
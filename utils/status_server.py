@@ -0,0 +1,99 @@
+import json
+import time
+import threading
+import logging
+from metrics import metrics
+from concurrency import limiter_states
+
+# Seconds between snapshots pushed to the status page
+PUSH_INTERVAL_SECONDS = 1.0
+
+STATUS_PAGE = """<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Run status</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+td, th { border: 1px solid #ccc; padding: 4px 10px; text-align: right; }
+th { background: #f4f4f4; }
+progress { width: 160px; }
+</style>
+</head>
+<body>
+<h2>Run status</h2>
+<table id="summary"></table>
+<table id="progress"></table>
+<table id="concurrency"></table>
+<script>
+const row = (cells, tag) => '<tr>' + cells.map(c => `<${tag}>${c}</${tag}>`).join('') + '</tr>';
+const source = new EventSource('events');
+source.onmessage = (event) => {
+  const s = JSON.parse(event.data);
+  document.getElementById('summary').innerHTML =
+    row(['uptime (s)', 'req/s (10s)', 'req/s (60s)', 'p50 ms', 'p90 ms', 'p99 ms', 'error rate', 'queue depth'], 'th') +
+    row([s.uptime_seconds, s.throughput.last_10s, s.throughput.last_60s, s.latency_ms.p50, s.latency_ms.p90,
+         s.latency_ms.p99, (s.error_rate * 100).toFixed(2) + '%', s.queue_depth], 'td');
+  document.getElementById('progress').innerHTML =
+    row(['context', 'kind', 'sent', 'planned', 'success', 'failed', 'progress'], 'th') +
+    s.progress.map(p => row([p.context, p.kind, p.sent, p.planned, p.success, p.failed,
+      `<progress max="${p.planned || 1}" value="${p.sent}"></progress>`], 'td')).join('');
+  document.getElementById('concurrency').innerHTML =
+    row(['kind', 'concurrency limit', 'in flight', 'ceiling', 'smoothed latency ms'], 'th') +
+    Object.entries(s.concurrency).map(([kind, c]) => row([kind, c.limit, c.in_flight, c.ceiling, c.latency_ms], 'td')).join('');
+};
+</script>
+</body>
+</html>
+"""
+
+_server = None
+
+# Request metrics plus each adaptive limiter's current concurrency
+def status_snapshot():
+    snapshot = metrics.snapshot()
+    snapshot['concurrency'] = limiter_states()
+    return snapshot
+
+def create_app():
+    from flask import Flask, Response
+    from flask_cors import CORS
+
+    app = Flask(__name__)
+    CORS(app)
+
+    @app.route('/')
+    def index():
+        return Response(STATUS_PAGE, mimetype='text/html')
+
+    @app.route('/status.json')
+    def status():
+        return status_snapshot()
+
+    # Server-sent events: one snapshot per interval for as long as the page is open
+    @app.route('/events')
+    def events():
+        def stream():
+            while True:
+                yield f"data: {json.dumps(status_snapshot())}\n\n"
+                time.sleep(PUSH_INTERVAL_SECONDS)
+        return Response(stream(), mimetype='text/event-stream')
+
+    return app
+
+# Address the status server binds to unless --statusHost says otherwise; only this machine can reach it
+DEFAULT_HOST = '127.0.0.1'
+
+# Serve the status page and JSON endpoint from a daemon thread; only the first call in a process starts a server
+def start_status_server(port, host=DEFAULT_HOST):
+    global _server
+    if _server is not None:
+        return _server
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    _server = make_server(host, port, create_app(), threaded=True)
+    threading.Thread(target=_server.serve_forever, name='status-server', daemon=True).start()
+    print(f"Status server listening on http://{host}:{port}/ (JSON at /status.json)")
+    return _server
@@ -0,0 +1,63 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# Which customers a run may send to, before sampling picks among them
+TARGETS = ['all', 'inactive', 'last-run']
+
+# Only customers with an external_id can receive transactions
+BASE_QUERY = {'external_id': {'$exists': True}}
+
+# Indexes on the customer collection that keep target selection and the newest strategy off full collection scans
+#   timestamp_lasttxn  - the newest strategy (sort by timestamp) and created-since ranges
+#   lasttxn_timestamp  - inactive customers (range on lasttxn_timestamp, plus never-transacted nulls)
+#   run_timestamp      - customers created in a given run
+USER_INDEXES = {
+    'timestamp_lasttxn': [('timestamp', -1), ('lasttxn_timestamp', 1)],
+    'lasttxn_timestamp': [('lasttxn_timestamp', 1), ('timestamp', -1)],
+    'run_timestamp': [('run_id', 1), ('timestamp', -1)],
+}
+
+# Id recorded as run_id on every customer a run creates (<context>-<UTC timestamp>-<random suffix>)
+# It also seeds the run's external ids, so two runs started in the same second must not share one
+def new_run_id(context):
+    return f"{context}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+# Create the customer indexes (a no-op for indexes that already exist)
+def ensure_user_indexes(collection):
+    for name, keys in USER_INDEXES.items():
+        collection.create_index(keys, name=name)
+
+# Id of the run that created the newest customer, or None before any run recorded one
+def latest_run_id(collection):
+    newest = collection.find_one({'run_id': {'$exists': True}}, {'_id': 0, 'run_id': 1}, sort=[('timestamp', -1)])
+    return newest['run_id'] if newest else None
+
+# Build the customer query for a target
+# lasttxn_timestamp is stored as a UTC ISO string by every writer, so the cutoff is compared as one
+def target_query(collection, target, inactive_days=30, now=None):
+    if target == 'all':
+        return dict(BASE_QUERY)
+    if target == 'inactive':
+        cutoff = ((now or datetime.now(timezone.utc)) - timedelta(days=inactive_days)).isoformat()
+        return {**BASE_QUERY, '$or': [{'lasttxn_timestamp': {'$lt': cutoff}}, {'lasttxn_timestamp': None}]}
+    if target == 'last-run':
+        run_id = latest_run_id(collection)
+        if run_id is None:
+            raise ValueError("No customers have a run_id yet; the last-run target needs customers from a run that records one.")
+        return {**BASE_QUERY, 'run_id': run_id}
+    raise ValueError(f"Unknown target: {target}")
+
+def _plan_stages(node):
+    if isinstance(node, dict):
+        stages = {node['stage']} if isinstance(node.get('stage'), str) else set()
+        for value in node.values():
+            stages |= _plan_stages(value)
+        return stages
+    if isinstance(node, list):
+        return set().union(*(_plan_stages(value) for value in node)) if node else set()
+    return set()
+
+# Ask the query planner how a query will run; True when it would scan the whole collection
+def uses_collection_scan(collection, query, projection=None):
+    plan = collection.find(query, projection).explain()
+    return 'COLLSCAN' in _plan_stages(plan.get('queryPlanner', {}).get('winningPlan', {}))
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Relative transaction volume for each local hour of the day (index 0 = midnight)
+DIURNAL_CURVES = {
+    # Shopping builds through the morning and peaks late afternoon / early evening
+    'retail': [0.2, 0.1, 0.1, 0.1, 0.1, 0.2, 0.4, 0.8, 1.4, 2.2, 3.2, 4.2,
+               4.8, 4.8, 4.6, 4.6, 5.0, 5.4, 5.6, 5.0, 4.0, 2.6, 1.4, 0.6],
+    # Breakfast, a sharp lunch peak and a dinner peak
+    'qsr':    [0.3, 0.2, 0.1, 0.1, 0.2, 0.6, 2.0, 4.2, 4.6, 3.0, 3.2, 6.8,
+               9.0, 6.4, 2.8, 2.2, 2.8, 5.2, 6.4, 5.0, 3.0, 1.8, 1.0, 0.6],
+    # Morning and evening commute peaks
+    'fuel':   [0.4, 0.3, 0.2, 0.2, 0.4, 1.4, 4.0, 6.2, 5.6, 3.2, 2.8, 3.0,
+               3.4, 3.2, 3.2, 3.8, 5.4, 6.6, 5.8, 3.6, 2.4, 1.6, 1.0, 0.6],
+}
+
+# Whole seconds (epoch) overlapping the window [start, start + duration)
+def _window_seconds(start, duration):
+    first = np.floor(start)
+    return first + np.arange(int(np.ceil(start + duration) - first), dtype=np.float64)
+
+# Per-second arrival rate for each timestamp (epoch seconds) given a target daily volume
+def arrival_rates(context, daily_volume, timestamps, utc_offset=0.0):
+    curve = np.asarray(DIURNAL_CURVES[context], dtype=np.float64)
+    hourly_share = curve / curve.sum()
+
+    # Interpolate between hour midpoints so the rate changes smoothly through the day
+    local_hours = ((np.asarray(timestamps, dtype=np.float64) / 3600.0) + utc_offset) % 24.0
+    midpoints = np.arange(-1, 25, dtype=np.float64) + 0.5
+    shares = np.interp(local_hours, midpoints, np.concatenate((hourly_share[-1:], hourly_share, hourly_share[:1])))
+    return daily_volume * shares / 3600.0
+
+# Generate Poisson arrival times (epoch seconds) for the window [start, start + duration)
+# Draws are vectorized: one Poisson count per second, then uniform offsets within each second
+def generate_arrivals(context, daily_volume, start, duration, utc_offset=0.0, rng=None):
+    rng = rng or np.random.default_rng()
+    seconds = _window_seconds(start, duration)
+    counts = rng.poisson(arrival_rates(context, daily_volume, seconds, utc_offset))
+    arrivals = np.repeat(seconds, counts) + rng.random(int(counts.sum()))
+    arrivals.sort()
+    return arrivals[(arrivals >= start) & (arrivals < start + duration)]
+
+# Expected number of arrivals in a window, useful for sizing samples and progress output
+def expected_volume(context, daily_volume, start, duration, utc_offset=0.0):
+    seconds = _window_seconds(start, duration)
+    covered = np.clip(np.minimum(seconds + 1, start + duration) - np.maximum(seconds, start), 0.0, 1.0)
+    return float((arrival_rates(context, daily_volume, seconds, utc_offset) * covered).sum())
+
+# Draw n times of day (seconds after UTC midnight) following the context's diurnal curve
+def sample_times_of_day(context, n, utc_offset=0.0, rng=None):
+    rng = rng or np.random.default_rng()
+    curve = np.asarray(DIURNAL_CURVES[context], dtype=np.float64)
+    local_hours = rng.choice(24, size=n, p=curve / curve.sum())
+    local_seconds = local_hours * 3600.0 + rng.random(n) * 3600.0
+    return (local_seconds - utc_offset * 3600.0) % 86400.0
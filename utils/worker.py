@@ -0,0 +1,152 @@
+import sys
+import os
+import argparse
+import logging
+import asyncio
+import signal
+import time
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import cli
+from job_queue import (CHUNKS_COLLECTION, DEFAULT_LEASE_SECONDS, MAX_CHUNK_SIZE, ensure_indexes, worker_identity, claim_chunk,
+                       renew_lease, complete_chunk, fail_chunk, expire_exhausted, has_open_chunks)
+from async_mongo import connect_async
+from coordinator import load_environment_variables
+from status_server import start_status_server
+from profiling import profiled
+from run_options import add_run_options
+from run_history import recorded
+
+# Configure logging
+def setup_logging():
+    LOG_DIR = 'logs'
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(LOG_DIR, 'worker.log'),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    return logger
+
+# Run one claimed chunk in-process through its CLI script
+# Customers are numbered from the chunk's offset in the run, so a reclaimed chunk reuses its external ids; on a
+# later attempt those ids are looked up in MongoDB, since the earlier attempt ran in another worker's process
+async def run_chunk(chunk, enable_logging):
+    params = chunk['params']
+    if chunk['command'] == 'customers':
+        module = cli.load_command('customers')
+        return await module.main(chunk['context'], params['send_txns'], enable_logging, params['locale'], count=params['count'],
+                                 run_id=chunk['run_id'], sequence_start=chunk['index'] * MAX_CHUNK_SIZE, recheck=chunk['attempts'] > 1)
+    raise ValueError(f"Unsupported chunk command: {chunk['command']}")
+
+# Renew the lease on a running chunk every third of the lease period until cancelled; returns once the lease is lost
+# (another worker reclaimed the chunk, or renewals kept failing until the lease ran out)
+async def keep_lease(chunks, chunk, worker_id, lease_seconds, logger):
+    expires = time.time() + lease_seconds
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        try:
+            renewed = await chunks.run(renew_lease, chunk, worker_id, lease_seconds)
+        except Exception as e:
+            logger.warning(f"Could not renew the lease on chunk {chunk['_id']}: {e}")
+            if time.time() < expires:
+                continue
+            renewed = False
+        if not renewed:
+            logger.warning(f"Lost lease on chunk {chunk['_id']}")
+            return
+        expires = time.time() + lease_seconds
+
+# Main function: claim and run chunks until the run is finished (or forever with follow) or SIGINT/SIGTERM
+async def run_worker(context, run_id, lease_seconds, poll_seconds, follow, enable_logging):
+    env_vars = load_environment_variables(context)
+    if enable_logging:
+        logger = setup_logging()
+    else:
+        logger = logging.getLogger(__name__)
+        logger.addHandler(logging.NullHandler())
+
+    # Queue calls run on the Mongo executor (async_mongo.py), so a slow MongoDB does not stall the chunk's requests
+    # or the lease renewals
+    chunks = connect_async(env_vars['MONGO_URI'], env_vars['MONGO_DB_NAME'])[CHUNKS_COLLECTION]
+    await chunks.run(ensure_indexes)
+    worker_id = worker_identity()
+
+    # Finish the chunk in hand on shutdown rather than abandoning its lease
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    counts = {"done": 0, "failed": 0, "lost": 0}
+    print(f"Worker {worker_id} started" + (f" for run {run_id}" if run_id else ""))
+    try:
+        while not stop_event.is_set():
+            await chunks.run(expire_exhausted, run_id)
+            chunk = await chunks.run(claim_chunk, worker_id, lease_seconds, run_id)
+            if chunk is None:
+                # Stay up while other workers hold leases, in case one is lost and needs reclaiming
+                if not follow and not await chunks.run(has_open_chunks, run_id):
+                    break
+                try:
+                    await asyncio.wait_for(stop_event.wait(), poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f"Claimed chunk {chunk['_id']} (attempt {chunk['attempts']})")
+            start = time.time()
+            # Each chunk is a run of its own in the run history; the worker's lifetime, mostly spent polling, is not
+            work = asyncio.create_task(recorded(f"worker-{chunk['command']}", chunk['context'], run_chunk(chunk, enable_logging)))
+            heartbeat = asyncio.create_task(keep_lease(chunks, chunk, worker_id, lease_seconds, logger))
+            try:
+                await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+                if not work.done():
+                    # Another worker may claim the chunk now, so stop sending its customers rather than double-send them
+                    work.cancel()
+                    await asyncio.gather(work, return_exceptions=True)
+                    counts["lost"] += 1
+                    print(f"Chunk {chunk['_id']} stopped after its lease was lost")
+                    continue
+                result = work.result() or {}
+                result['elapsed'] = round(time.time() - start, 3)
+                if await chunks.run(complete_chunk, chunk, worker_id, result):
+                    counts["done"] += 1
+                    print(f"Chunk {chunk['_id']} done in {result['elapsed']:.1f}s: {result}")
+                else:
+                    logger.warning(f"Chunk {chunk['_id']} finished after its lease was lost")
+                    print(f"Chunk {chunk['_id']} finished after its lease was lost")
+            except Exception as e:
+                counts["failed"] += 1
+                await chunks.run(fail_chunk, chunk, worker_id, str(e))
+                logger.error(f"Chunk {chunk['_id']} failed: {e}")
+                print(f"Chunk {chunk['_id']} failed: {e}")
+            finally:
+                work.cancel()
+                heartbeat.cancel()
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+    print(f"Worker {worker_id} stopped - chunks done: {counts['done']}, failed: {counts['failed']}, lost: {counts['lost']}")
+
+# Build the argument parser for this script
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description='Claim and run chunks of distributed runs created by the coordinator.')
+    parser.add_argument('--context', choices=['retail', 'qsr', 'fuel'], required=True, help='Context whose MongoDB holds the queue.')
+    parser.add_argument('--runId', help='Only work on this run (defaults to any run).')
+    parser.add_argument('--leaseSeconds', type=int, default=DEFAULT_LEASE_SECONDS, help='Lease length; unrenewed leases are reclaimed after this.')
+    parser.add_argument('--pollSeconds', type=float, default=5.0, help='Wait between claims when no chunk is available.')
+    parser.add_argument('--follow', action='store_true', help='Keep polling for new runs instead of exiting when the queue is empty.')
+    parser.add_argument('--enableLogging', action='store_true', help='Enable logging.')
+    add_run_options(parser, progress='while the worker runs chunks')
+    return parser
+
+# Run the script from parsed arguments
+def run(args):
+    if args.statusPort:
+        start_status_server(args.statusPort, args.statusHost)
+    return profiled(args.profile, 'worker', run_worker(
+        args.context, args.runId, args.leaseSeconds, args.pollSeconds, args.follow, args.enableLogging))
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args))